@@ -0,0 +1,119 @@
+import time
+import threading
+import numpy as np
+import flask_sqlalchemy
+from typing import Optional
+from models import Movie
+
+
+class HomePageRankings:
+    """In-memory rankings of the home page. Holds the IDs of the top rated movies and the IDs of
+    all movies to sample the movies to discover from, so that the home page does not have to
+    rank all movies on every request.
+
+    The rankings are refreshed when the rating aggregates changed (see invalidate) or when they
+    are older than max_age, either by a scheduled job or on the next request.
+    """
+
+    def __init__(
+        self, top_n: int = 24, num_discover: int = 24, max_age: float = 60 * 60
+    ) -> None:
+        """Initializes the HomePageRankings.
+
+        Arguments:
+            top_n (int): The number of top rated movies.
+            num_discover (int): The number of randomly sampled movies to discover.
+            max_age (float): The number of seconds after which the rankings are refreshed
+                even if no rating changed, e.g. to pick up an import from another process.
+        """
+
+        self.top_n = top_n
+        self.num_discover = num_discover
+        self.max_age = max_age
+
+        # Top movie IDs, all movie IDs and time of the last refresh, replaced at once on refresh
+        self.rankings: Optional[tuple[list[int], np.ndarray, float]] = None
+        self.stale = True
+        self.lock = threading.Lock()
+
+    def refresh(self, db: flask_sqlalchemy.extension.SQLAlchemy) -> None:
+        """Recomputes the rankings from the rating aggregates of all movies.
+
+        The movies are ranked by average rating weighted by number of ratings (their popularity)
+        i.e. a movie with a lot of ratings and a high average rating will be ranked higher than
+        one with a few ratings and a high average rating.
+
+        Arguments:
+            db (flask_sqlalchemy.extension.SQLAlchemy): The SQLAlchemy database object.
+        """
+
+        with self.lock:
+            # Ratings that arrive during the refresh mark the rankings as stale again
+            self.stale = False
+
+            results = db.session.query(
+                Movie.id, Movie.avg_rating, Movie.num_ratings
+            ).all()
+            if not results:
+                self.rankings = ([], np.empty(0, dtype=np.int64), time.monotonic())
+                return
+
+            movie_ids, average_ratings, num_ratings = map(np.asarray, zip(*results))
+
+            # Center the average ratings around 0, normalize the number of
+            # ratings and calculate sampling weights
+            num_ratings = num_ratings / max(np.max(num_ratings), 1)
+            scores = average_ratings + (average_ratings - 2.5) * num_ratings
+
+            top_indices = np.argsort(-scores, kind="stable")[: self.top_n]
+
+            self.rankings = (
+                [int(movie_id) for movie_id in movie_ids[top_indices]],
+                movie_ids,
+                time.monotonic(),
+            )
+
+    def refresh_if_needed(self, db: flask_sqlalchemy.extension.SQLAlchemy) -> None:
+        """Refreshes the rankings if they are stale or older than max_age.
+
+        Arguments:
+            db (flask_sqlalchemy.extension.SQLAlchemy): The SQLAlchemy database object.
+        """
+
+        rankings = self.rankings
+        if (
+            self.stale
+            or rankings is None
+            or time.monotonic() - rankings[2] > self.max_age
+        ):
+            self.refresh(db)
+
+    def invalidate(self) -> None:
+        """Marks the rankings as stale, e.g. after a rating was added or changed."""
+
+        self.stale = True
+
+    def sample(
+        self, db: flask_sqlalchemy.extension.SQLAlchemy
+    ) -> tuple[list[int], list[int]]:
+        """Gets the IDs of the top movies and of randomly sampled movies to discover.
+        The rankings are only computed here if they were never computed before.
+
+        Arguments:
+            db (flask_sqlalchemy.extension.SQLAlchemy): The SQLAlchemy database object.
+
+        Returns:
+            top_movie_ids (list[int]): The IDs of the top movies, best first.
+            discover_movie_ids (list[int]): The IDs of the movies to discover.
+        """
+
+        if self.rankings is None:
+            self.refresh(db)
+
+        top_movie_ids, movie_ids, _ = self.rankings
+
+        discover_movie_ids = np.random.choice(
+            movie_ids, min(self.num_discover, len(movie_ids)), replace=False
+        )
+
+        return top_movie_ids, [int(movie_id) for movie_id in discover_movie_ids]
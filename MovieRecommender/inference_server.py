@@ -0,0 +1,142 @@
+import time
+import queue
+import threading
+import numpy as np
+from typing import Callable
+from concurrent.futures import Future
+
+
+class InferenceServer:
+    """In-process inference server. Scoring requests of concurrent web requests are queued and
+    coalesced into micro-batches, which are scored by a single thread with one call of the model.
+    The predictions are scattered back to the callers through futures.
+    """
+
+    def __init__(
+        self,
+        predict: Callable[[np.ndarray, np.ndarray], np.ndarray],
+        max_batch_size: int = 65536,
+        max_wait_seconds: float = 0.005,
+    ) -> None:
+        """Initializes the InferenceServer and starts its worker thread.
+
+        Arguments:
+            predict (Callable[[np.ndarray, np.ndarray], np.ndarray]): Scores (user, movie) pairs,
+                e.g. Recommender.predict_pairs.
+            max_batch_size (int): The number of pairs after which a micro-batch is scored
+                without waiting for further requests.
+            max_wait_seconds (float): The maximum time the first request of a micro-batch waits for
+                further requests.
+        """
+
+        self.predict = predict
+        self.max_batch_size = max_batch_size
+        self.max_wait_seconds = max_wait_seconds
+
+        self.requests: queue.Queue = queue.Queue()
+        self.thread = threading.Thread(
+            target=self._run, name="inference-server", daemon=True
+        )
+        self.thread.start()
+
+    def submit(self, user_ids: np.ndarray, movie_ids: np.ndarray) -> Future:
+        """Queues (user, movie) pairs for scoring.
+
+        Arguments:
+            user_ids (np.ndarray): The zero-indexed user ids.
+            movie_ids (np.ndarray): The zero-indexed movie ids.
+
+        Returns:
+            Future: Resolves to the predicted ratings, one per pair.
+        """
+
+        future = Future()
+        self.requests.put(
+            (
+                np.asarray(user_ids, dtype=np.int64).flatten(),
+                np.asarray(movie_ids, dtype=np.int64).flatten(),
+                future,
+            )
+        )
+
+        return future
+
+    def predict_pairs(self, user_ids: np.ndarray, movie_ids: np.ndarray) -> np.ndarray:
+        """Scores (user, movie) pairs and waits for the result.
+
+        Arguments:
+            user_ids (np.ndarray): The zero-indexed user ids.
+            movie_ids (np.ndarray): The zero-indexed movie ids.
+
+        Returns:
+            np.ndarray: The predicted ratings, one per pair.
+        """
+
+        return self.submit(user_ids, movie_ids).result()
+
+    def _collect(self, first: tuple) -> tuple[list, bool]:
+        """Collects further requests for a micro-batch until it is full or the first request
+        waited max_wait_seconds.
+
+        Arguments:
+            first (tuple): The first request of the micro-batch.
+
+        Returns:
+            batch (list): The requests of the micro-batch.
+            stop (bool): Whether the server was closed in the meantime.
+        """
+
+        batch = [first]
+        size = len(first[0])
+        deadline = time.monotonic() + self.max_wait_seconds
+
+        while size < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+
+            try:
+                request = self.requests.get(timeout=timeout)
+            except queue.Empty:
+                break
+
+            if request is None:
+                return batch, True
+
+            batch.append(request)
+            size += len(request[0])
+
+        return batch, False
+
+    def _run(self) -> None:
+        """Scores micro-batches until the server is closed. Runs in the worker thread."""
+
+        stop = False
+        while not stop:
+            first = self.requests.get()
+            if first is None:
+                break
+
+            batch, stop = self._collect(first)
+
+            try:
+                predictions = self.predict(
+                    np.concatenate([user_ids for user_ids, _, _ in batch]),
+                    np.concatenate([movie_ids for _, movie_ids, _ in batch]),
+                )
+            except Exception as error:
+                for _, _, future in batch:
+                    future.set_exception(error)
+                continue
+
+            # Scatter the predictions back to the requests
+            start = 0
+            for user_ids, _, future in batch:
+                future.set_result(predictions[start : start + len(user_ids)])
+                start += len(user_ids)
+
+    def close(self) -> None:
+        """Scores the queued requests and stops the worker thread."""
+
+        self.requests.put(None)
+        self.thread.join()
@@ -35,7 +35,7 @@ class User(db.Model, UserMixin):
 
 class Movie(db.Model):
     """Movie model. Stores movie title and publication year.
-    Has a one-to-many relationship with MovieGenre, MovieLinks, MovieTags, and MovieRatings.
+    Has a one-to-many relationship with MovieGenre, MovieLinks, MovieTags, MovieTagSummary, and MovieRatings.
     """
 
     __tablename__ = "movies"
@@ -45,6 +45,12 @@ class Movie(db.Model):
     genres = db.relationship("MovieGenre", backref="movie", lazy=True)
     links = db.relationship("MovieLinks", backref="movie", lazy=True)
     tags = db.relationship("MovieTags", backref="movie", lazy=True)
+    tag_summaries = db.relationship(
+        "MovieTagSummary",
+        backref="movie",
+        lazy=True,
+        order_by="MovieTagSummary.rank",
+    )
     ratings = db.relationship("MovieRatings", backref="movie", lazy=True)
     avg_rating = db.Column(db.Float, nullable=False, server_default="0.0")
     num_ratings = db.Column(db.Integer, nullable=False, server_default="0")
@@ -88,6 +94,24 @@ class MovieTags(db.Model):
     )
 
 
+class MovieTagSummary(db.Model):
+    """Movie tag summary model. Stores the normalised (lowercased) tags of a movie with the number
+    of times they were given and their rank, sorted by count first and then alphabetically.
+    Precomputed from MovieTags, so that the tags of a page of movies can be loaded in one query.
+    """
+
+    __tablename__ = "movie_tag_summaries"
+    id = db.Column(db.Integer, primary_key=True)
+    movie_id = db.Column(
+        db.Integer, db.ForeignKey("movies.id"), nullable=False, index=True
+    )
+    tag = db.Column(db.String(255), nullable=False, server_default="")
+    count = db.Column(db.Integer, nullable=False, server_default="0")
+    rank = db.Column(db.Integer, nullable=False, server_default="0")
+
+    __table_args__ = (UniqueConstraint("movie_id", "tag", name="movie_tag_uc"),)
+
+
 class MovieRatings(db.Model):
     """Movie ratings model. Stores user id, movie id, and ratings.
     A UniqueConstraint is used to prevent duplicate ratings for a given user and movie.
@@ -101,3 +125,18 @@ class MovieRatings(db.Model):
     timestamp = db.Column(db.DateTime())
 
     __table_args__ = (UniqueConstraint("user_id", "movie_id", name="user_movie_uc"),)
+
+
+class UserRecommendation(db.Model):
+    """User recommendation model. Stores the top recommendations of the recommender model for a user,
+    with their predicted rating and the version of the model weights they were computed with.
+    """
+
+    __tablename__ = "user_recommendations"
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(
+        db.Integer, db.ForeignKey("users.id"), nullable=False, index=True
+    )
+    movie_id = db.Column(db.Integer, db.ForeignKey("movies.id"), nullable=False)
+    score = db.Column(db.Float, nullable=False)
+    weights_version = db.Column(db.String(64), nullable=False, server_default="")
@@ -0,0 +1,246 @@
+import json
+import time
+import sqlite3
+import requests
+import threading
+from typing import Iterable, Optional
+from requests.adapters import HTTPAdapter
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+
+# Errors OMDb answers unknown or malformed imdb ids with, the only failures cached for negative_ttl
+NOT_FOUND_ERRORS = ("Movie not found!", "Incorrect IMDb ID.")
+
+
+class MovieInfoCache:
+    """Persistent cache of OMDb movie infos (plot descriptions etc.), keyed by imdb id.
+
+    Infos are stored in a SQLite file, so they survive restarts. Every entry expires after a TTL,
+    failed lookups are cached as well, so that missing movies or a broken upstream are not
+    requested on every page view. Movies that are not found are cached with a shorter TTL,
+    transient errors (timeouts, connection errors, 5xx) only briefly. Misses are fetched by a
+    bounded pool of threads with timeouts, a page only waits a limited time for them.
+    """
+
+    def __init__(
+        self,
+        path: str = "movie_info_cache.sqlite",
+        base_url: str = "http://www.omdbapi.com/",
+        api_key: str = "",
+        ttl: float = 30 * 24 * 60 * 60,
+        negative_ttl: float = 60 * 60,
+        error_ttl: float = 60,
+        num_workers: int = 8,
+        timeout: tuple[float, float] = (2, 5),
+        wait_seconds: float = 1.0,
+    ) -> None:
+        """Initializes the MovieInfoCache.
+
+        Arguments:
+            path (str): The path of the SQLite cache file.
+            base_url (str): The base URL of the OMDb API, can point to a local stub server.
+            api_key (str): The OMDb API key.
+            ttl (float): The number of seconds a fetched movie info is valid.
+            negative_ttl (float): The number of seconds a movie that was not found is cached.
+            error_ttl (float): The number of seconds any other failed lookup is cached.
+            num_workers (int): The maximum number of concurrent requests to the OMDb API.
+            timeout (tuple[float, float]): The connect and read timeout of every request in seconds.
+            wait_seconds (float): The maximum time a page waits for missing movie infos.
+                Fetches that take longer finish in the background and are cached for the next page view.
+        """
+
+        self.path = path
+        self.base_url = base_url
+        self.api_key = api_key
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.error_ttl = error_ttl
+        self.timeout = timeout
+        self.wait_seconds = wait_seconds
+
+        self.executor = ThreadPoolExecutor(
+            max_workers=num_workers, thread_name_prefix="movie-info"
+        )
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_maxsize=num_workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        # Fetches that are currently running, so that an imdb id is never requested twice at once
+        self.in_flight: dict[str, Future] = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+        with self._connection() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS movie_info ("
+                "imdb_id TEXT PRIMARY KEY, info TEXT, expires_at REAL NOT NULL)"
+            )
+
+    def _connection(self) -> sqlite3.Connection:
+        """Gets the SQLite connection of the current thread.
+
+        Returns:
+            sqlite3.Connection: The connection.
+        """
+
+        if not hasattr(self.local, "connection"):
+            self.local.connection = sqlite3.connect(self.path, timeout=10)
+            self.local.connection.execute("PRAGMA journal_mode=WAL")
+
+        return self.local.connection
+
+    def _lookup(self, imdb_ids: list[str]) -> dict[str, Optional[dict]]:
+        """Looks up unexpired cache entries with a single query.
+
+        Arguments:
+            imdb_ids (list[str]): The imdb ids to look up.
+
+        Returns:
+            dict[str, Optional[dict]]: The cached movie infos, None for cached failed lookups.
+        """
+
+        placeholders = ",".join("?" * len(imdb_ids))
+        rows = self._connection().execute(
+            f"SELECT imdb_id, info FROM movie_info "
+            f"WHERE imdb_id IN ({placeholders}) AND expires_at > ?",
+            (*imdb_ids, time.time()),
+        )
+
+        return {
+            imdb_id: json.loads(info) if info is not None else None
+            for imdb_id, info in rows
+        }
+
+    def _store(self, imdb_id: str, info: Optional[dict], ttl: float) -> None:
+        """Stores a movie info or a failed lookup in the cache.
+
+        Arguments:
+            imdb_id (str): The imdb id.
+            info (Optional[dict]): The movie info, None if the lookup failed.
+            ttl (float): The number of seconds the entry is valid.
+        """
+
+        with self._connection() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO movie_info VALUES (?, ?, ?)",
+                (
+                    imdb_id,
+                    json.dumps(info) if info is not None else None,
+                    time.time() + ttl,
+                ),
+            )
+
+    def _fetch(self, imdb_id: str) -> Optional[dict]:
+        """Fetches a movie info from the OMDb API and caches it. Runs in the thread pool.
+
+        Arguments:
+            imdb_id (str): The imdb id, without the "tt" prefix.
+
+        Returns:
+            Optional[dict]: The movie info or None if the lookup failed.
+        """
+
+        info, ttl = None, self.error_ttl
+
+        try:
+            response = self.session.get(
+                self.base_url,
+                params={"i": f"tt{imdb_id}", "apikey": self.api_key},
+                timeout=self.timeout,
+            )
+            if response.status_code == 404:
+                ttl = self.negative_ttl
+            else:
+                response.raise_for_status()
+                info = response.json()
+                # OMDb answers unknown ids (and invalid keys) with "Response": "False"
+                if info.get("Response") == "False":
+                    if info.get("Error") in NOT_FOUND_ERRORS:
+                        ttl = self.negative_ttl
+                    else:
+                        print(f"Failed to fetch movie info for tt{imdb_id}: {info}")
+                    info = None
+                else:
+                    ttl = self.ttl
+        except (requests.RequestException, ValueError) as error:
+            print(f"Failed to fetch movie info for tt{imdb_id}: {error}")
+            info = None
+
+        # A failing cache must not fail the page, the info is fetched again next time
+        try:
+            self._store(imdb_id, info, ttl)
+        except sqlite3.Error as error:
+            print(f"Failed to cache movie info for tt{imdb_id}: {error}")
+        finally:
+            with self.lock:
+                self.in_flight.pop(imdb_id, None)
+
+        return info
+
+    def _submit(self, imdb_ids: Iterable[str]) -> dict[str, Future]:
+        """Starts fetching movie infos that are not already being fetched.
+
+        Arguments:
+            imdb_ids (Iterable[str]): The imdb ids to fetch.
+
+        Returns:
+            dict[str, Future]: The fetches of all given imdb ids.
+        """
+
+        futures = {}
+        with self.lock:
+            for imdb_id in imdb_ids:
+                if imdb_id not in self.in_flight:
+                    self.in_flight[imdb_id] = self.executor.submit(
+                        self._fetch, imdb_id
+                    )
+                futures[imdb_id] = self.in_flight[imdb_id]
+
+        return futures
+
+    def get_many(self, imdb_ids: list[str]) -> dict[str, Optional[dict]]:
+        """Gets the movie infos of multiple movies. Cached infos are returned immediately,
+        missing ones are fetched, waiting at most wait_seconds for them.
+
+        Arguments:
+            imdb_ids (list[str]): The imdb ids, without the "tt" prefix.
+
+        Returns:
+            dict[str, Optional[dict]]: The movie infos, None if the lookup failed or did not finish in time.
+        """
+
+        imdb_ids = list(dict.fromkeys(imdb_id for imdb_id in imdb_ids if imdb_id))
+        if not imdb_ids:
+            return {}
+
+        movie_infos = self._lookup(imdb_ids)
+        futures = self._submit(
+            imdb_id for imdb_id in imdb_ids if imdb_id not in movie_infos
+        )
+
+        done, _ = wait(futures.values(), timeout=self.wait_seconds)
+        for imdb_id, future in futures.items():
+            movie_infos[imdb_id] = future.result() if future in done else None
+
+        return movie_infos
+
+    def prefetch(self, imdb_ids: list[str]) -> None:
+        """Fetches missing movie infos in the background without waiting for them,
+        e.g. for the next page of a list.
+
+        Arguments:
+            imdb_ids (list[str]): The imdb ids, without the "tt" prefix.
+        """
+
+        imdb_ids = list(dict.fromkeys(imdb_id for imdb_id in imdb_ids if imdb_id))
+        if not imdb_ids:
+            return
+
+        cached = self._lookup(imdb_ids)
+        self._submit(imdb_id for imdb_id in imdb_ids if imdb_id not in cached)
+
+    def close(self) -> None:
+        """Waits for running fetches and closes the thread pool and the session."""
+
+        self.executor.shutdown(wait=True)
+        self.session.close()
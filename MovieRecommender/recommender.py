@@ -13,28 +13,57 @@ os.chdir(__location__)
 
 import click
 import sqlite3
+import subprocess
 import datetime
 import numpy as np
-from typing import Union
+from time import perf_counter
+from typing import Optional, Union
 import tensorflow as tf
 from threading import Lock
-from fuzzywuzzy import fuzz
 from werkzeug.wrappers import Response
 
 from flask import Flask, render_template, flash, request, redirect, session, url_for
 
-from flask_user.signals import user_registered
-from flask_user import login_required, UserManager, current_user
+from flask_user.signals import user_registered, user_logged_in
+from flask_user import login_required, current_user
 
 from apscheduler.schedulers.background import BackgroundScheduler
 
 from sqlalchemy.engine import Engine
-from sqlalchemy import event, not_, case
+from sqlalchemy import event
+from sqlalchemy.orm import joinedload
 from sqlalchemy.exc import IntegrityError
 
-from models import db, User, Movie, MovieRatings
-from recommender_model import Recommender, train_model
-from utils import check_and_read_data, get_movie_metadata, CustomPagination
+from models import db, User, Movie, MovieLinks, MovieRatings, UserRecommendation
+from movie_info_cache import MovieInfoCache
+from home_page_rankings import HomePageRankings
+from title_search import TitleSearchIndex
+from inference_server import InferenceServer
+from recommender_model import (
+    Recommender,
+    RetrievalModel,
+    ALSRecommender,
+    read_weights_version,
+    read_weights_metadata,
+    can_fine_tune,
+    weights_path,
+    grow_models,
+    train_model,
+    fine_tune_model,
+    train_als_model,
+)
+from utils import (
+    check_and_read_data,
+    get_movie_metadata,
+    hash_placeholder_password,
+    update_movie_aggregates,
+    get_cached_recommendations,
+    store_recommendations,
+    invalidate_recommendations,
+    CustomPagination,
+    METADATA_LOAD_OPTIONS,
+    PlaceholderPasswordUserManager,
+)
 
 # Register numpy int32 as a converter to sqlite3
 sqlite3.register_adapter(np.int32, lambda val: int(val))
@@ -42,7 +71,9 @@ sqlite3.register_adapter(np.int32, lambda val: int(val))
 
 @event.listens_for(Engine, "connect")
 def set_sqlite_pragma(dbapi_connection, connection_record) -> None:
-    """Sets the foreign key pragma on SQLite databases.
+    """Sets the foreign key pragma on SQLite databases. The write-ahead log lets the
+    training process read the ratings while the web process writes new ones. Registers
+    unicode_lower(), as the built-in lower() of SQLite only lowercases ASCII characters.
 
     Arguments:
         dbapi_connection (sqlite3.Connection): Active SQLite connection.
@@ -51,8 +82,16 @@ def set_sqlite_pragma(dbapi_connection, connection_record) -> None:
 
     cursor = dbapi_connection.cursor()
     cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.execute("PRAGMA journal_mode=WAL")
     cursor.close()
 
+    dbapi_connection.create_function(
+        "unicode_lower",
+        1,
+        lambda value: value.lower() if isinstance(value, str) else value,
+        deterministic=True,
+    )
+
 
 class ConfigClass(object):
     """Flask application config."""
@@ -77,6 +116,40 @@ class ConfigClass(object):
     USER_AFTER_LOGIN_ENDPOINT = "home_page"
     USER_AFTER_LOGOUT_ENDPOINT = "home_page"
 
+    # OMDb settings, the base URL can point to a local stub server
+    OMDB_BASE_URL = "http://www.omdbapi.com/"
+    OMDB_API_KEY = ""
+    # Movie infos are cached on disk, movies that were not found for a shorter time
+    # and transient errors (timeouts, connection errors, 5xx) only briefly
+    MOVIE_INFO_CACHE_PATH = "movie_info_cache.sqlite"
+    MOVIE_INFO_TTL = 30 * 24 * 60 * 60
+    MOVIE_INFO_NEGATIVE_TTL = 60 * 60
+    MOVIE_INFO_ERROR_TTL = 60
+    # Maximum number of concurrent OMDb requests and time a page waits for them
+    MOVIE_INFO_WORKERS = 8
+    MOVIE_INFO_WAIT_SECONDS = 1.0
+    # Fetch the movie infos of the next page in the background
+    MOVIE_INFO_PREFETCH = True
+
+    # Number of movies in the home page carousels, the rankings are refreshed
+    # every minute if ratings changed and at least every HOME_PAGE_MAX_AGE seconds
+    HOME_PAGE_TOP_N = 24
+    HOME_PAGE_NUM_DISCOVER = 24
+    HOME_PAGE_MAX_AGE = 60 * 60
+
+    # Minimum fuzzy ratio (0 - 100) of a search result and number of cached search queries
+    SEARCH_THRESHOLD = 45
+    SEARCH_CACHE_SIZE = 1024
+
+    # Scoring requests of concurrent requests are coalesced into micro-batches of up to
+    # INFERENCE_MAX_BATCH_SIZE pairs, waiting at most INFERENCE_MAX_WAIT_SECONDS for further requests
+    INFERENCE_MAX_BATCH_SIZE = 65536
+    INFERENCE_MAX_WAIT_SECONDS = 0.005
+
+    # The trained recommendation engine: "neural" (the neural network re-ranks the candidates
+    # of the retrieval model) or "als" (matrix factorization, trained in seconds)
+    RECOMMENDER_ENGINE = "neural"
+
 
 # Create Flask app
 app = Flask(__name__)
@@ -84,16 +157,42 @@ app.config.from_object(__name__ + ".ConfigClass")
 app.app_context().push()
 db.init_app(app)
 db.create_all()
-user_manager = UserManager(app, db, User)
-
-
-# Used to retrain the recommender model every n new ratings
+user_manager = PlaceholderPasswordUserManager(app, db, User)
+movie_info_cache = MovieInfoCache(
+    path=app.config["MOVIE_INFO_CACHE_PATH"],
+    base_url=app.config["OMDB_BASE_URL"],
+    api_key=app.config["OMDB_API_KEY"],
+    ttl=app.config["MOVIE_INFO_TTL"],
+    negative_ttl=app.config["MOVIE_INFO_NEGATIVE_TTL"],
+    error_ttl=app.config["MOVIE_INFO_ERROR_TTL"],
+    num_workers=app.config["MOVIE_INFO_WORKERS"],
+    wait_seconds=app.config["MOVIE_INFO_WAIT_SECONDS"],
+)
+home_page_rankings = HomePageRankings(
+    top_n=app.config["HOME_PAGE_TOP_N"],
+    num_discover=app.config["HOME_PAGE_NUM_DISCOVER"],
+    max_age=app.config["HOME_PAGE_MAX_AGE"],
+)
+title_search_index = TitleSearchIndex(
+    threshold=app.config["SEARCH_THRESHOLD"],
+    cache_size=app.config["SEARCH_CACHE_SIZE"],
+)
+
+
+# Used to retrain the recommender model every n new ratings. The latest weights are
+# fine-tuned on the new ratings, every FULL_RETRAIN_EVERY-th time the models are trained
+# on all ratings from scratch
 RETRAIN_EVERY = 100
+FULL_RETRAIN_EVERY = 10
 new_ratings_counter = 1
 
-# Define lock. Used to prevent user registration while
-# training the recommender model
-retraining_lock = Lock()
+# The training runs in a separate process with a lower priority than the web process
+TRAINING_NICENESS = 10
+training_process = None
+
+# Define lock. Used to swap in new weights without losing users
+# that are registered in the meantime
+model_lock = Lock()
 
 if "initdb" not in sys.argv:
     HIDDEN_SIZE = 2048
@@ -102,34 +201,110 @@ if "initdb" not in sys.argv:
     BATCH_SIZE = 512
     LEARNING_RATE = 0.001
     EPOCHS = 10
+    # Incremental training mixes every new rating with REPLAY_RATIO older ones
+    # and is bounded to FINE_TUNE_STEPS steps
+    REPLAY_RATIO = 4
+    FINE_TUNE_STEPS = 200
+    # The retrieval model proposes NUM_CANDIDATES movies, which are re-ranked by the recommender
+    RETRIEVAL_EMBEDDING_DIM = 64
+    NUM_CANDIDATES = 300
+    # Used by the "als" engine
+    ALS_FACTORS = 64
+    ALS_REGULARIZATION = 10.0
+    ALS_ITERATIONS = 15
     NUM_UNIQUE_USERS = len(User.query.with_entities(User.id).all())
     UNIQUE_MOVIES = Movie.query.with_entities(Movie.id).all()
     UNIQUE_MOVIES_VOCAB = [str(movie[0]) for movie in UNIQUE_MOVIES]
     NUM_UNIQUE_MOVIES = len(UNIQUE_MOVIES)
 
-    if "train" not in sys.argv:
-        print("Loading recommender model...")
-        # Load recommender model with the latest weights
-        recommender_model = Recommender(
-            hidden_size=HIDDEN_SIZE,
-            embedding_dim=EMBEDDING_DIM,
-            dropout=DROPOUT,
-            num_users=NUM_UNIQUE_USERS,
-            num_movies=NUM_UNIQUE_MOVIES,
-            movie_vocab=UNIQUE_MOVIES_VOCAB,
+
+def load_models(
+    version: str, num_users: int
+) -> tuple[Union[Recommender, ALSRecommender], Optional[RetrievalModel]]:
+    """Loads the recommender model and the retrieval model with the weights of a version.
+    The engine is the one the version was trained with. Users registered after the weights
+    were trained are added to the models.
+
+    Arguments:
+        version (str): The weights version.
+        num_users (int): The current number of users.
+
+    Returns:
+        recommender_model (Union[Recommender, ALSRecommender]): The recommender model.
+        retrieval_model (Optional[RetrievalModel]): The retrieval model, None if there are no
+            retrieval weights (i.e. before the next training or for the ALS engine),
+            then all unrated movies are ranked.
+    """
+
+    metadata = read_weights_metadata(version)
+    trained_num_users = metadata.get("num_users", num_users)
+
+    if metadata.get("engine") == "als":
+        recommender_model = ALSRecommender(
+            num_factors=ALS_FACTORS,
+            regularization=ALS_REGULARIZATION,
+            num_users=trained_num_users,
+            movie_ids=[int(movie_id) for movie_id in UNIQUE_MOVIES_VOCAB],
         )
-        recommender_model.load_weights("weights/recommender_weights")
-        recommender_model.build((None, 2))
-        print("Recommender model weights loaded.")
+        recommender_model.load_weights(weights_path(version, "als_weights"))
+        grow_models(recommender_model, None, num_users)
+
+        return recommender_model, None
+
+    recommender_model = Recommender(
+        hidden_size=HIDDEN_SIZE,
+        embedding_dim=EMBEDDING_DIM,
+        dropout=DROPOUT,
+        num_users=trained_num_users,
+        num_movies=NUM_UNIQUE_MOVIES,
+        movie_vocab=UNIQUE_MOVIES_VOCAB,
+    )
+    recommender_model.load_weights(weights_path(version, "recommender_weights"))
+    recommender_model.build((None, 2))
+
+    retrieval_model = None
+    if os.path.exists(weights_path(version, "retrieval_weights.index")):
+        retrieval_model = RetrievalModel(
+            embedding_dim=RETRIEVAL_EMBEDDING_DIM,
+            num_users=trained_num_users,
+            movie_ids=[int(movie_id) for movie_id in UNIQUE_MOVIES_VOCAB],
+        )
+        retrieval_model(tf.zeros((1, 2), dtype=tf.int64), training=False)
+        retrieval_model.load_weights(weights_path(version, "retrieval_weights"))
+
+    grow_models(recommender_model, retrieval_model, num_users)
+
+    return recommender_model, retrieval_model
+
+
+if "initdb" not in sys.argv and "train" not in sys.argv:
+    print("Loading recommender model...")
+    # Load recommender model with the latest weights
+    weights_version = read_weights_version()
+    recommender_model, retrieval_model = load_models(weights_version, NUM_UNIQUE_USERS)
+    print("Recommender model weights loaded.")
+
+    inference_server = InferenceServer(
+        predict=recommender_model.predict_pairs,
+        max_batch_size=app.config["INFERENCE_MAX_BATCH_SIZE"],
+        max_wait_seconds=app.config["INFERENCE_MAX_WAIT_SECONDS"],
+    )
 
 
 @app.cli.command("initdb")
 @click.option("--rebuild", is_flag=True, help="Rebuild the entire database.")
-def initdb_command(rebuild: bool) -> None:
+@click.option(
+    "--password-mode",
+    type=click.Choice(["parallel", "placeholder"]),
+    default="parallel",
+    help="Hash the passwords of imported users on all cores or store placeholders that are hashed on first login.",
+)
+def initdb_command(rebuild: bool, password_mode: str) -> None:
     """Creates the database tables.
 
     Arguments:
         rebuild (bool): Whether to rebuild the entire database.
+        password_mode (str): How the passwords of imported users are created.
     """
 
     if rebuild:
@@ -139,27 +314,119 @@ def initdb_command(rebuild: bool) -> None:
     # Create new tables
     db.create_all()
 
-    check_and_read_data(db=db, user_manager=user_manager)
+    check_and_read_data(db=db, user_manager=user_manager, password_mode=password_mode)
     print("Initialized the database.")
 
 
 @app.cli.command("train")
-def train_command() -> None:
-    """Trains the recommender model."""
+@click.option(
+    "--incremental",
+    is_flag=True,
+    help="Fine-tune the latest weights on the ratings added since they were trained.",
+)
+@click.option(
+    "--niceness",
+    default=0,
+    help="Increment of the process niceness, i.e. lower priority (POSIX only).",
+)
+@click.option(
+    "--precompute",
+    is_flag=True,
+    help="Precompute the recommendations of all users with the new weights afterwards.",
+)
+def train_command(incremental: bool, niceness: int, precompute: bool) -> None:
+    """Trains the recommender model and publishes its weights as a new version,
+    which a running web process loads without restarting.
 
-    print("Training recommender model...")
-    train_model(
-        hidden_size=HIDDEN_SIZE,
-        embedding_dim=EMBEDDING_DIM,
-        dropout=DROPOUT,
-        batch_size=BATCH_SIZE,
-        learning_rate=LEARNING_RATE,
-        epochs=EPOCHS,
-        num_users=NUM_UNIQUE_USERS,
-        num_movies=NUM_UNIQUE_MOVIES,
-        movie_vocab=UNIQUE_MOVIES_VOCAB,
+    Arguments:
+        incremental (bool): Whether to fine-tune the latest weights instead of training from scratch.
+        niceness (int): Increment of the process niceness.
+        precompute (bool): Whether to precompute the recommendations with the new weights.
+    """
+
+    if niceness and hasattr(os, "nice"):
+        os.nice(niceness)
+
+    if app.config["RECOMMENDER_ENGINE"] == "als":
+        # Always trained from scratch, which only takes seconds
+        print("Training ALS model...")
+        version = train_als_model(
+            num_factors=ALS_FACTORS,
+            regularization=ALS_REGULARIZATION,
+            iterations=ALS_ITERATIONS,
+            num_users=NUM_UNIQUE_USERS,
+            movie_vocab=UNIQUE_MOVIES_VOCAB,
+        )
+        print("Trained the model.")
+
+    elif incremental and can_fine_tune(read_weights_metadata(read_weights_version())):
+        print("Fine-tuning recommender model...")
+        version = fine_tune_model(
+            hidden_size=HIDDEN_SIZE,
+            embedding_dim=EMBEDDING_DIM,
+            dropout=DROPOUT,
+            batch_size=BATCH_SIZE,
+            learning_rate=LEARNING_RATE,
+            epochs=EPOCHS,
+            num_users=NUM_UNIQUE_USERS,
+            num_movies=NUM_UNIQUE_MOVIES,
+            movie_vocab=UNIQUE_MOVIES_VOCAB,
+            retrieval_embedding_dim=RETRIEVAL_EMBEDDING_DIM,
+            replay_ratio=REPLAY_RATIO,
+            max_steps=FINE_TUNE_STEPS,
+        )
+        print("Fine-tuned the model.")
+
+    else:
+        if incremental:
+            print(
+                "The latest weights are unversioned, of another engine or their snapshot "
+                "was deleted, training from scratch instead."
+            )
+
+        print("Training recommender model...")
+        version = train_model(
+            hidden_size=HIDDEN_SIZE,
+            embedding_dim=EMBEDDING_DIM,
+            dropout=DROPOUT,
+            batch_size=BATCH_SIZE,
+            learning_rate=LEARNING_RATE,
+            epochs=EPOCHS,
+            num_users=NUM_UNIQUE_USERS,
+            num_movies=NUM_UNIQUE_MOVIES,
+            movie_vocab=UNIQUE_MOVIES_VOCAB,
+            retrieval_embedding_dim=RETRIEVAL_EMBEDDING_DIM,
+        )
+        print("Trained the model.")
+
+    if precompute:
+        precompute_with_weights(version)
+        print("Precomputed the recommendations.")
+
+
+def precompute_with_weights(version: str) -> None:
+    """Loads a weights version in this process and precomputes the recommendations of all users
+    with it. Used by the training process, so that the web process keeps its inference capacity
+    for live requests.
+
+    Arguments:
+        version (str): The weights version.
+    """
+
+    global recommender_model, retrieval_model, inference_server, weights_version
+
+    with app.app_context():
+        num_users = User.query.count()
+
+    recommender_model, retrieval_model = load_models(version, num_users)
+    weights_version = version
+    inference_server = InferenceServer(
+        predict=recommender_model.predict_pairs,
+        max_batch_size=app.config["INFERENCE_MAX_BATCH_SIZE"],
+        max_wait_seconds=app.config["INFERENCE_MAX_WAIT_SECONDS"],
     )
-    print("Trained the model.")
+
+    precompute_recommendations()
 
 
 @app.template_filter("isinteger")
@@ -181,52 +448,307 @@ def isinteger(value: any) -> bool:
 @user_registered.connect_via(app)
 def _after_register_hook(sender, user, **extra) -> None:
     """Adds the user to the recommender model after registration.
-    In case the recommender model is being trained, the user is added after training.
+    In case new weights are being swapped in, the user is added to the new models.
 
     Arguments:
         sender (flask.Flask): The Flask app.
         user (User): The user that was registered.
         extra (dict): Extra arguments.
     """
-    with retraining_lock:
+    with model_lock:
         recommender_model.add_user()
+        if retrieval_model is not None:
+            retrieval_model.add_user()
 
 
-def retrain_recommender_model() -> None:
-    """Retrains the recommender model every 100 new ratings."""
+@user_logged_in.connect_via(app)
+def _after_login_hook(sender, user, **extra) -> None:
+    """Hashes the placeholder password of an imported user on first login.
 
-    global new_ratings_counter
+    Arguments:
+        sender (flask.Flask): The Flask app.
+        user (User): The user that logged in.
+        extra (dict): Extra arguments.
+    """
+
+    hash_placeholder_password(db=db, user_manager=user_manager, user=user)
+
+
+@app.cli.command("benchmark")
+@click.option("--num-users", default=20, help="Number of users to score.")
+def benchmark_command(num_users: int) -> None:
+    """Compares the latency of scoring all movies for a user with the full forward pass
+    and with the cached movie activations.
+
+    Arguments:
+        num_users (int): Number of users to score.
+    """
+
+    if not isinstance(recommender_model, Recommender):
+        raise click.ClickException("The benchmark requires the neural engine.")
+
+    movie_ids = np.asarray([int(movie_id) for movie_id in UNIQUE_MOVIES_VOCAB])
+    user_ids = np.random.choice(NUM_UNIQUE_USERS, num_users, replace=False)
+
+    # Warm up both paths, also computes the cached movie activations
+    recommender_model.predict_user(0, movie_ids - 1)
+    recommender_model(np.stack([np.zeros_like(movie_ids), movie_ids - 1], axis=1))
+
+    full_seconds, cached_seconds, max_difference = 0.0, 0.0, 0.0
+    for user_id in user_ids:
+        data = tf.convert_to_tensor(
+            np.stack([np.full_like(movie_ids, user_id), movie_ids - 1], axis=1)
+        )
 
-    with retraining_lock:
-        with app.app_context():
-            if new_ratings_counter % RETRAIN_EVERY == 0:
-                UNIQUE_USERS = len(User.query.with_entities(User.id).all())
-
-                print("Retraining recommender model...")
-                train_model(
-                    hidden_size=HIDDEN_SIZE,
-                    embedding_dim=EMBEDDING_DIM,
-                    dropout=DROPOUT,
-                    batch_size=BATCH_SIZE,
-                    learning_rate=LEARNING_RATE,
-                    epochs=EPOCHS,
-                    num_users=UNIQUE_USERS,
-                    num_movies=NUM_UNIQUE_MOVIES,
-                    movie_vocab=UNIQUE_MOVIES_VOCAB,
+        start_time = perf_counter()
+        full = recommender_model(data, training=False).numpy().flatten()
+        full_seconds += perf_counter() - start_time
+
+        start_time = perf_counter()
+        cached = recommender_model.predict_user(user_id, movie_ids - 1)
+        cached_seconds += perf_counter() - start_time
+
+        max_difference = max(max_difference, float(np.max(np.abs(full - cached))))
+
+    print(f"Scored {len(movie_ids)} movies for {num_users} users")
+    print(f"Full forward pass: {full_seconds / num_users * 1000:.1f} ms per user")
+    print(f"Cached movie tower: {cached_seconds / num_users * 1000:.1f} ms per user")
+    print(f"Maximum difference of the predictions: {max_difference:.2e}")
+
+
+def compute_recommendations(
+    user_ids: list[int], num_recommendations: int = 30
+) -> dict[int, dict[int, float]]:
+    """Computes the top recommendations of multiple users. Candidates are retrieved among the
+    unseen movies of every user and ranked by the recommender model in large batches.
+
+    Arguments:
+        user_ids (list[int]): The IDs of the users.
+        num_recommendations (int): The number of recommendations per user.
+
+    Returns:
+        dict[int, dict[int, float]]: The recommended movie IDs and their predicted ratings,
+            sorted by predicted rating, for each user ID.
+    """
+
+    # Get the rated movies of all users with a single query
+    rated_movies = {user_id: [] for user_id in user_ids}
+    for user_id, movie_id in MovieRatings.query.filter(
+        MovieRatings.user_id.in_(user_ids)
+    ).with_entities(MovieRatings.user_id, MovieRatings.movie_id):
+        rated_movies[user_id].append(movie_id)
+
+    if retrieval_model is None:
+        all_movies = np.asarray([int(movie_id) for movie_id in UNIQUE_MOVIES_VOCAB])
+
+    candidates = {}
+    for user_id in user_ids:
+        if retrieval_model is not None:
+            # Subtract 1 from user_id to make it zero-indexed
+            candidates[user_id] = retrieval_model.retrieve(
+                user_id - 1, NUM_CANDIDATES, exclude_movie_ids=rated_movies[user_id]
+            )
+        else:
+            candidates[user_id] = all_movies[
+                ~np.isin(all_movies, rated_movies[user_id])
+            ]
+
+    # Rank the candidates of all users at once, together with concurrent requests
+    # Subtract 1 from user_id and movie_id to make them zero-indexed
+    pair_user_ids = np.concatenate(
+        [np.full(len(movies), user_id - 1) for user_id, movies in candidates.items()]
+    )
+    pair_movie_ids = np.concatenate(list(candidates.values()))
+    predictions = inference_server.predict_pairs(pair_user_ids, pair_movie_ids - 1)
+
+    recommendations = {}
+    start = 0
+    for user_id, movies in candidates.items():
+        user_predictions = predictions[start : start + len(movies)]
+        start += len(movies)
+
+        top = np.argsort(-user_predictions, kind="stable")[:num_recommendations]
+        recommendations[user_id] = {
+            int(movies[index]): float(user_predictions[index]) for index in top
+        }
+
+    return recommendations
+
+
+@app.cli.command("export")
+@click.option(
+    "--format",
+    "export_format",
+    type=click.Choice(["savedmodel", "tflite"]),
+    default="savedmodel",
+    help="Export a TensorFlow SavedModel or a TFLite model.",
+)
+@click.option(
+    "--output",
+    default=None,
+    help="Path of the export, defaults to exports/recommender(.tflite).",
+)
+def export_command(export_format: str, output: str) -> None:
+    """Exports the recommender model with its compiled serving signature, which takes a [batch, 2]
+    int64 tensor of zero-indexed user and movie ids and returns the predicted ratings.
+
+    Arguments:
+        export_format (str): Either "savedmodel" or "tflite".
+        output (str): The path of the export.
+    """
+
+    if not isinstance(recommender_model, Recommender):
+        raise click.ClickException("Only the neural engine can be exported.")
+
+    if output is None:
+        output = "exports/recommender" + (".tflite" if export_format == "tflite" else "")
+
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    recommender_model.export(output, export_format=export_format)
+    print(f"Exported the recommender model to {output}")
+
+    max_difference = recommender_model.check_export(output, export_format=export_format)
+    print(f"Maximum difference of the exported predictions: {max_difference:.2e}")
+
+
+@app.cli.command("recommend")
+@click.option("--batch-size", default=64, help="Number of users scored at once.")
+def recommend_command(batch_size: int) -> None:
+    """Precomputes the recommendations of all users with the current weights,
+    so that the recommendations page does not have to run the model.
+
+    Arguments:
+        batch_size (int): Number of users scored at once.
+    """
+
+    precompute_recommendations(batch_size, show_progress=True)
+    print("\nPrecomputed the recommendations.")
+
+
+def precompute_recommendations(
+    batch_size: int = 64, show_progress: bool = False
+) -> None:
+    """Precomputes the recommendations of all users with the current weights and removes the
+    ones of previous weights. Runs in the training process after every training started by the
+    web process, see train_command.
+
+    Arguments:
+        batch_size (int): Number of users scored at once.
+        show_progress (bool): Whether to print the number of processed users.
+    """
+
+    with app.app_context():
+        user_ids = [user_id for (user_id,) in User.query.with_entities(User.id)]
+
+        start_time = perf_counter()
+        for start in range(0, len(user_ids), batch_size):
+            batch = user_ids[start : start + batch_size]
+            store_recommendations(
+                db=db,
+                recommendations=compute_recommendations(batch),
+                weights_version=weights_version,
+            )
+            if show_progress:
+                done = start + len(batch)
+                print(
+                    f"Computed recommendations of {done} users "
+                    f"({done / (perf_counter() - start_time):.1f} users/s)",
+                    end="\r",
                 )
-                print("Retrained the model.")
 
-                recommender_model.load_weights("weights/recommender_weights")
-                recommender_model.build((None, 2))
+        # Remove recommendations of previous weights
+        UserRecommendation.query.filter(
+            UserRecommendation.weights_version != weights_version
+        ).delete()
+        db.session.commit()
+
+
+def retrain_recommender_model() -> None:
+    """Starts retraining the recommender model in a separate process every 100 new ratings.
+    The latest weights are fine-tuned, unless they were fine-tuned FULL_RETRAIN_EVERY - 1
+    times already. The web process keeps serving with the current weights, see load_new_weights.
+    """
 
-                print("Retrained recommender model weights loaded.")
-                new_ratings_counter = 1
+    global new_ratings_counter, training_process
+
+    if new_ratings_counter < RETRAIN_EVERY:
+        return
+
+    # Wait for the previous training to finish
+    if training_process is not None and training_process.poll() is None:
+        return
+
+    command = [
+        sys.executable,
+        "-m",
+        "flask",
+        "--app",
+        "recommender.py",
+        "train",
+        "--niceness",
+        str(TRAINING_NICENESS),
+        "--precompute",
+    ]
+    fine_tunes = read_weights_metadata(weights_version).get("fine_tunes")
+    if fine_tunes is not None and fine_tunes < FULL_RETRAIN_EVERY - 1:
+        command.append("--incremental")
+
+    print("Retraining recommender model...")
+    training_process = subprocess.Popen(command, cwd=__location__)
+    new_ratings_counter = 1
+
+
+def load_new_weights() -> None:
+    """Hot-swaps the models if a newer weights version was published (by the training process
+    or the train command). The new models are loaded while the current ones keep serving,
+    the swap itself only briefly holds the model lock.
+    """
 
+    global recommender_model, retrieval_model, weights_version
+
+    version = read_weights_version()
+    if version == weights_version:
+        return
+
+    with app.app_context():
+        num_users = User.query.count()
+
+    new_recommender_model, new_retrieval_model = load_models(version, num_users)
+
+    with model_lock:
+        # Add the users that registered while the models were loaded
+        grow_models(
+            new_recommender_model, new_retrieval_model, recommender_model.num_users
+        )
 
-# Create and start background scheduler
+        recommender_model = new_recommender_model
+        retrieval_model = new_retrieval_model
+        inference_server.predict = recommender_model.predict_pairs
+        weights_version = version
+
+    print("Retrained recommender model weights loaded.")
+
+
+def refresh_home_page_rankings() -> None:
+    """Refreshes the home page rankings if ratings changed or they are outdated."""
+
+    with app.app_context():
+        home_page_rankings.refresh_if_needed(db=db)
+
+
+# Create background scheduler
 scheduler = BackgroundScheduler()
-scheduler.add_job(func=retrain_recommender_model, trigger="interval", minutes=0.5)
-scheduler.start()
+
+
+def start_scheduler() -> None:
+    """Adds the background jobs and starts the scheduler. Only called by the serving process,
+    so that CLI commands and the reloader process neither start trainings nor load weights.
+    """
+
+    scheduler.add_job(func=retrain_recommender_model, trigger="interval", minutes=0.5)
+    scheduler.add_job(func=load_new_weights, trigger="interval", seconds=10)
+    scheduler.add_job(func=refresh_home_page_rankings, trigger="interval", minutes=1)
+    scheduler.start()
 
 
 @app.route("/")
@@ -238,43 +760,22 @@ def home_page() -> str:
         str: Rendered home page.
     """
 
-    # Get top 24 movies based on average rating weighted by number of ratings (their popularity)
-    # i.e. a movie with a lot of ratings and a high average rating will be ranked higher than
-    # one with a few ratings and a high average rating
-
-    # Query the database
-    results = Movie.query.with_entities(
-        Movie.id, Movie.avg_rating, Movie.num_ratings
-    ).all()
-    movie_ids, average_ratings, num_ratings = zip(*results)
-    id_rating_dict = dict(zip(movie_ids, average_ratings))
-
-    # Center the average ratings around 0, normalize the number of
-    # ratings and calculate sampling weights
-    average_ratings = np.asarray(average_ratings) - 2.5
-    num_ratings = np.asarray(num_ratings) / np.max(num_ratings)
-    sampling_weights = np.multiply(average_ratings, num_ratings)
-
-    # Add sampling weights to the values of the dictionary
-    for idx, (key, value) in enumerate(id_rating_dict.items()):
-        id_rating_dict[key] = value + sampling_weights[idx]
-
-    # Sort the dictionary by the values and get the top 24 movie IDs
-    id_rating_dict = dict(
-        sorted(id_rating_dict.items(), key=lambda x: x[1], reverse=True)
-    )
-    sampled_indices = list(id_rating_dict.keys())[:24]
-
-    # Query the database to get the movie objects and sort to keep the order of sampled_indices
-    top_movies = Movie.query.filter(Movie.id.in_(sampled_indices)).all()
-    top_movies.sort(key=lambda movie: sampled_indices.index(movie.id))
+    # The top 24 movies and 24 randomly sampled movies are taken from the cached rankings
+    top_movie_ids, discover_movie_ids = home_page_rankings.sample(db=db)
 
-    # Get 24 randomly sampled movies
-    sampled_indices = np.random.choice(
-        np.asarray(movie_ids).flatten(), 24, replace=False
+    # Query the movie objects and their links with a single query
+    movies = (
+        Movie.query.options(joinedload(Movie.links))
+        .filter(Movie.id.in_(top_movie_ids + discover_movie_ids))
+        .all()
     )
-    sampled_indices = [int(id) for id in sampled_indices]
-    discover_movies = Movie.query.filter(Movie.id.in_(sampled_indices)).all()
+    movies_dict = {movie.id: movie for movie in movies}
+
+    # Keep the order of the rankings
+    top_movies = [movies_dict[id] for id in top_movie_ids if id in movies_dict]
+    discover_movies = [
+        movies_dict[id] for id in discover_movie_ids if id in movies_dict
+    ]
 
     return render_template(
         "home.html", top_movies=top_movies, discover_movies=discover_movies
@@ -306,13 +807,30 @@ def movies() -> str:
     """
 
     page = request.args.get("page", 1, type=int)
-    movies = Movie.query.paginate(page=page, per_page=10)
+    movies = (
+        Movie.query.options(*METADATA_LOAD_OPTIONS)
+        .order_by(Movie.id)
+        .paginate(page=page, per_page=10)
+    )
 
     # Get movie tags, average ratings, and user ratings
     movie_tags, average_ratings, user_ratings, movie_plot_dict = get_movie_metadata(
-        db=db, movies=movies, current_user=current_user
+        db=db,
+        movies=movies,
+        current_user=current_user,
+        movie_info_cache=movie_info_cache,
     )
 
+    if app.config["MOVIE_INFO_PREFETCH"] and movies.has_next:
+        next_imdb_ids = (
+            db.session.query(MovieLinks.imdb_id)
+            .join(Movie)
+            .order_by(Movie.id)
+            .offset(page * 10)
+            .limit(10)
+        )
+        movie_info_cache.prefetch([imdb_id for (imdb_id,) in next_imdb_ids])
+
     # Add the movie info to the movie objects
     for m in movies:
         m.movie_info = movie_plot_dict.get(m.id)
@@ -340,41 +858,21 @@ def movies_search() -> Union[redirect, str]:
     page = request.args.get("page", 1, type=int)
     search_query = request.args.get("query", "", type=str)
 
+    # Only the query is stored in the session, the results are cached by the search index
     if search_query:
-        all_movies = Movie.query.all()
-
-        # Calculate fuzzy ratios and store them with the corresponding movie in a list of tuples
-        movie_ratios = [
-            (movie, fuzz.ratio(movie.title.lower(), search_query.lower()))
-            for movie in all_movies
-        ]
-
-        # Sort the list of tuples based on the fuzzy ratio
-        movie_ratios.sort(key=lambda x: x[1], reverse=True)
-
-        # Find the index where the fuzzy ratio falls below the threshold
-        threshold = 45  # Set your desired threshold here
-        index = next(
-            (
-                index
-                for index, (movie, ratio) in enumerate(movie_ratios)
-                if ratio < threshold
-            ),
-            len(movie_ratios),
-        )
-
-        # Discard movies that don't meet the threshold and store their IDs in the session
-        session["all_searched_movie_ids"] = [
-            movie.id for movie, ratio in movie_ratios[:index]
-        ]
+        session["search_query"] = search_query
 
     # If no search query was provided, redirect to the movies page
     # If no movies were found, display a flash message
-    if session.get("all_searched_movie_ids") is None:
+    if session.get("search_query") is None:
         flash("No search query was provided", "error")
         return redirect(url_for("movies"))
 
-    elif len(session["all_searched_movie_ids"]) == 0:
+    all_searched_movie_ids = title_search_index.search(
+        db=db, query=session["search_query"]
+    )
+
+    if len(all_searched_movie_ids) == 0:
         flash("No movies were found", "error")
         return render_template(
             "movies_search.html",
@@ -384,11 +882,15 @@ def movies_search() -> Union[redirect, str]:
             user_ratings={},
         )
 
-    total = len(session["all_searched_movie_ids"])
-    movie_ids = session["all_searched_movie_ids"][(page - 1) * 10 : page * 10]
+    total = len(all_searched_movie_ids)
+    movie_ids = all_searched_movie_ids[(page - 1) * 10 : page * 10]
 
     # Query the database to get the movie objects
-    movies = Movie.query.filter(Movie.id.in_(movie_ids)).all()
+    movies = (
+        Movie.query.options(*METADATA_LOAD_OPTIONS)
+        .filter(Movie.id.in_(movie_ids))
+        .all()
+    )
 
     # Create a dictionary with movie IDs as keys and movies as values
     movies_dict = {movie.id: movie for movie in movies}
@@ -399,9 +901,19 @@ def movies_search() -> Union[redirect, str]:
     movies = CustomPagination(movies, page, 10, total)
 
     movie_tags, average_ratings, user_ratings, movie_plot_dict = get_movie_metadata(
-        db=db, movies=movies, current_user=current_user
+        db=db,
+        movies=movies,
+        current_user=current_user,
+        movie_info_cache=movie_info_cache,
     )
 
+    next_movie_ids = all_searched_movie_ids[page * 10 : (page + 1) * 10]
+    if app.config["MOVIE_INFO_PREFETCH"] and next_movie_ids:
+        next_imdb_ids = db.session.query(MovieLinks.imdb_id).filter(
+            MovieLinks.movie_id.in_(next_movie_ids)
+        )
+        movie_info_cache.prefetch([imdb_id for (imdb_id,) in next_imdb_ids])
+
     # Add the movie info to the movie objects
     for m in movies:
         m.movie_info = movie_plot_dict.get(m.id)
@@ -451,7 +963,10 @@ def rate_movie() -> Response:
                 timestamp=datetime.date.today(),
             )
             db.session.add(movie_rating)
+            update_movie_aggregates(db=db, movie_id=movie_id, rating=rating)
+            invalidate_recommendations(db=db, user_id=current_user.id)
             db.session.commit()
+            home_page_rankings.invalidate()
             flash("Movie rated successfully", flash_category)
 
         else:
@@ -460,9 +975,17 @@ def rate_movie() -> Response:
             ).first()
 
             if not movie_rating.rating == rating:
+                update_movie_aggregates(
+                    db=db,
+                    movie_id=movie_id,
+                    rating=rating,
+                    previous_rating=movie_rating.rating,
+                )
                 movie_rating.rating = rating
                 movie_rating.timestamp = datetime.date.today()
+                invalidate_recommendations(db=db, user_id=current_user.id)
                 db.session.commit()
+                home_page_rankings.invalidate()
                 flash("Rating updated successfully", flash_category)
 
         new_ratings_counter += 1
@@ -477,8 +1000,8 @@ def rate_movie() -> Response:
 @app.route("/movie_recommender")
 @login_required
 def movie_recommender() -> str:
-    """Renders the movie recommender page. Calls recommender model on
-    all unseen movies of the logged in user and gets their movie objects + metadata.
+    """Renders the movie recommender page. Gets the cached recommendations of the logged in user
+    (computing them if there are none) and their movie objects + metadata.
 
     Returns:
         str: Rendered movie recommender page.
@@ -486,49 +1009,33 @@ def movie_recommender() -> str:
 
     user_id = current_user.id
 
-    # Get all movie IDs that the current user has rated
-    rated_movies = MovieRatings.query.filter_by(user_id=user_id).with_entities(
-        MovieRatings.movie_id
-    )
-    # Get all movies not in rated_movies
-    unrated_movies = (
-        Movie.query.filter(not_(Movie.id.in_(rated_movies)))
-        .with_entities(Movie.id)
-        .all()
-    )
-
-    user_id = np.expand_dims(np.asarray([user_id] * len(unrated_movies)), axis=1)
-    unrated_movies = np.asarray(unrated_movies)
-
-    # Get recommendations for the current user
-    # Subtract 1 from user_id and movie_id to make them zero-indexed
-    data = tf.convert_to_tensor(
-        np.concatenate((user_id - 1, unrated_movies - 1), axis=1)
-    )
-    predictions = recommender_model(data, training=False).numpy()
-
-    # Combine movie IDs and predictions into a dictionary and sort by prediction
-    recommendations_dict = dict(zip(unrated_movies.flatten(), predictions.flatten()))
-    recommendations_dict = dict(
-        sorted(recommendations_dict.items(), key=lambda x: x[1], reverse=True)
+    # Use the precomputed recommendations, unless the user rated a movie or new weights were loaded
+    recommendations_dict = get_cached_recommendations(
+        db=db, user_id=user_id, weights_version=weights_version
     )
+    if recommendations_dict is None:
+        recommendations_dict = compute_recommendations([user_id])[user_id]
+        store_recommendations(
+            db=db,
+            recommendations={user_id: recommendations_dict},
+            weights_version=weights_version,
+        )
 
     # Get the top 30 recommendations, their movie objects and metadata
     recommendation_ids = list(recommendations_dict.keys())[:30]
-    recommendation_ids = [int(id) for id in recommendation_ids]
 
-    # Define the ordering
-    order = case(
-        {id: index for index, id in enumerate(recommendation_ids)}, value=Movie.id
-    )
+    # The movies are ordered in Python below
     movie_recommendations = (
-        Movie.query.filter(Movie.id.in_(recommendation_ids)).order_by(order).all()
+        Movie.query.options(*METADATA_LOAD_OPTIONS)
+        .filter(Movie.id.in_(recommendation_ids))
+        .all()
     )
     movie_tags, average_ratings, _, movie_plot_dict = get_movie_metadata(
         db=db,
         movies=movie_recommendations,
         current_user=current_user,
         get_user_ratings=False,
+        movie_info_cache=movie_info_cache,
     )
 
     rating_weights = {
@@ -553,9 +1060,9 @@ def movie_recommender() -> str:
         sorted(rating_weights.items(), key=lambda x: x[1], reverse=True)
     )
 
-    order = case({id: index for index, id in enumerate(rating_weights)}, value=Movie.id)
-    movie_recommendations = (
-        Movie.query.filter(Movie.id.in_(list(rating_weights))).order_by(order).all()
+    # Reorder the already loaded movie objects
+    movie_recommendations.sort(
+        key=lambda movie: rating_weights.get(movie.id, -np.inf), reverse=True
     )
 
     # Add the movie info to the movie objects
@@ -572,4 +1079,8 @@ def movie_recommender() -> str:
 
 # Start development web server
 if __name__ == "__main__":
+    # In debug mode the app is served by a child process of the reloader, marked by WERKZEUG_RUN_MAIN
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        start_scheduler()
+
     app.run(port=5000, debug=True)
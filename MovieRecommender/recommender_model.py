@@ -1,8 +1,108 @@
-import random
+import os
+import json
+import uuid
+import shutil
 import numpy as np
+import scipy.sparse
 import tensorflow as tf
+from time import perf_counter
+from typing import Optional, Union
+from sqlalchemy import text
 
-from models import MovieRatings
+from models import db
+
+# Every training writes its weights to weights/<version>, this file points to the latest version
+LATEST_WEIGHTS_FILE = "weights/LATEST"
+# Columnar snapshots of all ratings the models are trained on, one dir per export
+SNAPSHOT_DIR = "data/ratings_snapshots"
+
+
+def _resize_embedding(
+    layer: tf.keras.layers.Embedding, capacity: int
+) -> tf.keras.layers.Embedding:
+    """Creates an embedding layer with a different number of rows, which are copied from a layer.
+    If the layer is not built yet, i.e. it has no rows, the new layer is not built either.
+
+    Arguments:
+        layer (tf.keras.layers.Embedding): The layer to copy.
+        capacity (int): The number of rows of the new layer.
+
+    Returns:
+        tf.keras.layers.Embedding: The new layer.
+    """
+
+    resized = tf.keras.layers.Embedding(capacity, layer.output_dim)
+    if not layer.built:
+        return resized
+
+    resized(0)
+
+    rows = min(capacity, layer.input_dim)
+    resized.embeddings[:rows].assign(layer.embeddings[:rows])
+
+    return resized
+
+
+def _add_user(model: tf.keras.Model, layer_names: list[str]) -> bool:
+    """Adds a new user to the user embedding layers of a model by assigning the average row of
+    the known users to the next free row. The average is computed once after the weights were
+    loaded. The layers are preallocated with spare rows, if they are full their capacity is
+    doubled, so adding a user takes constant amortized time.
+
+    Arguments:
+        model (tf.keras.Model): The model, with num_users and average_user_rows attributes.
+        layer_names (list[str]): The attribute names of the user embedding layers.
+
+    Returns:
+        bool: Whether the layers were replaced to grow their capacity.
+    """
+
+    if model.average_user_rows is None:
+        model.average_user_rows = {
+            name: tf.reduce_mean(
+                getattr(model, name).embeddings[: model.num_users], axis=0
+            )
+            for name in layer_names
+        }
+
+    resized = False
+    for name in layer_names:
+        layer = getattr(model, name)
+        if model.num_users >= layer.input_dim:
+            layer = _resize_embedding(layer, 2 * max(model.num_users, 1))
+            setattr(model, name, layer)
+            resized = True
+
+        # Scatter the row, indexing the variable would read all of its rows
+        layer.embeddings.scatter_update(
+            tf.IndexedSlices(
+                model.average_user_rows[name][tf.newaxis], [model.num_users]
+            )
+        )
+
+    model.num_users += 1
+
+    return resized
+
+
+def _match_checkpoint_capacity(
+    model: tf.keras.Model, filepath: str, layer_names: list[str]
+) -> None:
+    """Resizes the user embedding layers of a model to the number of rows in a checkpoint,
+    which includes the spare rows of the model that saved it.
+
+    Arguments:
+        model (tf.keras.Model): The model.
+        filepath (str): The path of the checkpoint.
+        layer_names (list[str]): The attribute names of the user embedding layers.
+    """
+
+    shapes = tf.train.load_checkpoint(filepath).get_variable_to_shape_map()
+
+    for name in layer_names:
+        rows = shapes[f"{name}/embeddings/.ATTRIBUTES/VARIABLE_VALUE"][0]
+        if rows != getattr(model, name).input_dim:
+            setattr(model, name, _resize_embedding(getattr(model, name), rows))
 
 
 class Recommender(tf.keras.Model):
@@ -36,8 +136,18 @@ class Recommender(tf.keras.Model):
 
         self.movie_lookup = tf.keras.layers.StringLookup(vocabulary=movie_vocab)
 
+        # Dense table mapping every integer model input to the index of the StringLookup,
+        # so that ids do not have to be converted to strings on every call
+        max_movie_id = max(int(movie_id) for movie_id in movie_vocab)
+        self.movie_index_table = tf.cast(
+            self.movie_lookup(tf.as_string(tf.range(max_movie_id + 1))), tf.int64
+        )
+
+        # Has at least num_users rows, rows of new users are added by add_user
         self.user_embedding = tf.keras.layers.Embedding(num_users, embedding_dim)
         self.movie_embedding = tf.keras.layers.Embedding(num_movies, embedding_dim)
+        # Average embedding of the known users, assigned to new users
+        self.average_user_rows = None
 
         self.dense1 = tf.keras.layers.Dense(hidden_size / 2, activation="relu")
         self.dropout1 = tf.keras.layers.Dropout(dropout)
@@ -61,30 +171,80 @@ class Recommender(tf.keras.Model):
 
         self.output_layer = tf.keras.layers.Dense(1, activation="sigmoid")
 
-    def call(self, inputs, training=True) -> tf.Tensor:
-        """Performs forward pass on the model.
+        # Movie tower activations of all movies, computed once per weight load for inference
+        self.movie_activations = None
+        # Compiled inference function, traced again when layers are replaced
+        self.score_function = None
+
+    def lookup_movies(self, movie_ids) -> tf.Tensor:
+        """Maps movie ids, as passed to the model, to indices in the movie embedding.
+        Gives the same indices as the StringLookup, ids outside the table map to 0 (unknown).
 
         Arguments:
-            inputs (tf.Tensor): The input tensor containing the user and movie ids.
+            movie_ids (tf.Tensor): The zero-indexed movie ids.
+
+        Returns:
+            tf.Tensor: The indices in the movie embedding.
+        """
+
+        movie_ids = tf.cast(movie_ids, tf.int64)
+        table_size = tf.shape(self.movie_index_table, out_type=tf.int64)[0]
+
+        indices = tf.gather(
+            self.movie_index_table, tf.clip_by_value(movie_ids, 0, table_size - 1)
+        )
+        in_table = (movie_ids >= 0) & (movie_ids < table_size)
+
+        return tf.where(in_table, indices, tf.zeros_like(indices))
+
+    def user_tower(self, user_ids, training=True) -> tf.Tensor:
+        """Computes the user branch of the model.
+
+        Arguments:
+            user_ids (tf.Tensor): The zero-indexed user ids.
             training (bool): Whether or not the model is currently training.
 
         Returns:
-            output (tf.Tensor): The output tensor containing the predicted ratings.
+            tf.Tensor: The user vectors.
         """
 
-        # User and movie vectors are first passed through a dense layer and are then
-        # concatenated together before being passed through the rest of the model
-        user_vector = self.user_embedding(inputs[:, 0], training=training)
+        user_vector = self.user_embedding(user_ids, training=training)
         user_vector = self.dense1(user_vector, training=training)
         user_vector = self.dropout1(user_vector, training=training)
         user_vector = self.batch_norm1(user_vector, training=training)
 
-        movie_vector = self.movie_lookup(tf.as_string(inputs[:, 1]))
-        movie_vector = self.movie_embedding(movie_vector, training=training)
+        return user_vector
+
+    def movie_tower(self, movie_indices, training=True) -> tf.Tensor:
+        """Computes the movie branch of the model.
+
+        Arguments:
+            movie_indices (tf.Tensor): The indices of the movies in the movie embedding.
+            training (bool): Whether or not the model is currently training.
+
+        Returns:
+            tf.Tensor: The movie vectors.
+        """
+
+        movie_vector = self.movie_embedding(movie_indices, training=training)
         movie_vector = self.dense2(movie_vector, training=training)
         movie_vector = self.dropout2(movie_vector, training=training)
         movie_vector = self.batch_norm2(movie_vector, training=training)
 
+        return movie_vector
+
+    def head(self, user_vector, movie_vector, training=True) -> tf.Tensor:
+        """Computes the layers after the concatenation of user and movie vectors.
+
+        Arguments:
+            user_vector (tf.Tensor): The user vectors.
+            movie_vector (tf.Tensor): The movie vectors.
+            training (bool): Whether or not the model is currently training.
+
+        Returns:
+            tf.Tensor: The predicted ratings.
+        """
+
         x = self.dense3(
             tf.concat([user_vector, movie_vector], axis=1), training=training
         )
@@ -103,67 +263,917 @@ class Recommender(tf.keras.Model):
 
         return output
 
+    def call(self, inputs, training=True) -> tf.Tensor:
+        """Performs forward pass on the model.
+
+        Arguments:
+            inputs (tf.Tensor): The input tensor containing the user and movie ids.
+            training (bool): Whether or not the model is currently training.
+
+        Returns:
+            output (tf.Tensor): The output tensor containing the predicted ratings.
+        """
+
+        # User and movie vectors are first passed through a dense layer and are then
+        # concatenated together before being passed through the rest of the model
+        user_vector = self.user_tower(inputs[:, 0], training=training)
+
+        movie_indices = self.lookup_movies(inputs[:, 1])
+        movie_vector = self.movie_tower(movie_indices, training=training)
+
+        return self.head(user_vector, movie_vector, training=training)
+
+    @tf.function(input_signature=[tf.TensorSpec([None, 2], tf.int64)])
+    def serve(self, inputs) -> tf.Tensor:
+        """Compiled inference signature with a dynamic batch dimension,
+        used for exporting the model.
+
+        Arguments:
+            inputs (tf.Tensor): The input tensor containing the zero-indexed user and movie ids.
+
+        Returns:
+            tf.Tensor: The predicted ratings, one per row.
+        """
+
+        return tf.reshape(self.call(inputs, training=False), [-1])
+
+    def export(self, path: str, export_format: str = "savedmodel") -> None:
+        """Exports the model with the serve signature for a separate serving process.
+
+        Arguments:
+            path (str): The path of the SavedModel dir or the TFLite file.
+            export_format (str): Either "savedmodel" or "tflite".
+        """
+
+        concrete_function = self.serve.get_concrete_function()
+
+        if export_format == "savedmodel":
+            # Keras only saves models whose input shape is known from a call of the model,
+            # the app only builds the model and scores through the towers
+            self(tf.zeros((1, 2), dtype=tf.int64), training=False)
+            tf.saved_model.save(
+                self, path, signatures={"serving_default": concrete_function}
+            )
+        elif export_format == "tflite":
+            converter = tf.lite.TFLiteConverter.from_concrete_functions(
+                [concrete_function], self
+            )
+            with open(path, "wb") as file:
+                file.write(converter.convert())
+        else:
+            raise ValueError(f"Unknown export format: {export_format}")
+
+    def check_export(
+        self, path: str, export_format: str = "savedmodel", num_pairs: int = 256
+    ) -> float:
+        """Loads an export and compares its predictions for random (user, movie) pairs
+        with the predictions of the model.
+
+        Arguments:
+            path (str): The path of the SavedModel dir or the TFLite file.
+            export_format (str): Either "savedmodel" or "tflite".
+            num_pairs (int): The number of compared pairs.
+
+        Returns:
+            float: The maximum absolute difference of the predictions.
+        """
+
+        inputs = np.stack(
+            [
+                np.random.randint(0, self.num_users, num_pairs),
+                np.random.randint(0, self.num_movies, num_pairs),
+            ],
+            axis=1,
+        ).astype(np.int64)
+
+        if export_format == "savedmodel":
+            serve = tf.saved_model.load(path).signatures["serving_default"]
+            (exported,) = serve(inputs=tf.constant(inputs)).values()
+            exported = exported.numpy()
+        elif export_format == "tflite":
+            interpreter = tf.lite.Interpreter(model_path=path)
+            input_index = interpreter.get_input_details()[0]["index"]
+            interpreter.resize_tensor_input(input_index, inputs.shape)
+            interpreter.allocate_tensors()
+            interpreter.set_tensor(input_index, inputs)
+            interpreter.invoke()
+            exported = interpreter.get_tensor(
+                interpreter.get_output_details()[0]["index"]
+            )
+        else:
+            raise ValueError(f"Unknown export format: {export_format}")
+
+        predictions = self.predict_pairs(inputs[:, 0], inputs[:, 1])
+
+        return float(np.max(np.abs(exported.flatten() - predictions)))
+
+    def load_weights(self, filepath, *args, **kwargs):
+        """Loads the model weights and invalidates the cached movie activations.
+        Takes the same arguments as tf.keras.Model.load_weights.
+        """
+
+        _match_checkpoint_capacity(self, filepath, ["user_embedding"])
+
+        status = super().load_weights(filepath, *args, **kwargs)
+        self.movie_activations = None
+        self.average_user_rows = None
+        self.score_function = None
+
+        return status
+
+    def predict_pairs(
+        self, user_ids: np.ndarray, movie_ids: np.ndarray, batch_size: int = 65536
+    ) -> np.ndarray:
+        """Predicts the ratings of many (user, movie) pairs. The movie branch does not depend on
+        the user, so its activations are computed once for all movies and cached. The user branch
+        is computed once per distinct user, only the layers after the concatenation run per pair.
+
+        Arguments:
+            user_ids (np.ndarray): The zero-indexed user ids.
+            movie_ids (np.ndarray): The zero-indexed movie ids, as passed to the model.
+            batch_size (int): The maximum number of pairs passed through the model at once.
+
+        Returns:
+            np.ndarray: The predicted ratings, one per pair.
+        """
+
+        movie_activations = self.movie_activations
+        if movie_activations is None:
+            movie_activations = self.movie_tower(
+                tf.range(self.num_movies), training=False
+            )
+            self.movie_activations = movie_activations
+
+        # Only use the local reference, add_user may reset the attribute concurrently
+        score_function = self.score_function
+        if score_function is None:
+            # A fixed input signature, so that the function is traced only once for all batch sizes
+            score_function = tf.function(
+                self.score_pairs,
+                input_signature=[
+                    tf.TensorSpec([None], tf.int64),
+                    tf.TensorSpec([None], tf.int64),
+                    tf.TensorSpec([None, None], tf.float32),
+                ],
+            )
+            self.score_function = score_function
+
+        user_ids = np.asarray(user_ids, dtype=np.int64).flatten()
+        movie_ids = np.asarray(movie_ids, dtype=np.int64).flatten()
+
+        predictions = [
+            score_function(
+                user_ids[start : start + batch_size],
+                movie_ids[start : start + batch_size],
+                movie_activations,
+            ).numpy()
+            for start in range(0, len(movie_ids), batch_size)
+        ]
+
+        return np.concatenate(predictions) if predictions else np.empty(0)
+
+    def score_pairs(self, user_ids, movie_ids, movie_activations) -> tf.Tensor:
+        """Scores (user, movie) pairs with the cached movie activations. Compiled by predict_pairs.
+
+        Arguments:
+            user_ids (tf.Tensor): The zero-indexed user ids.
+            movie_ids (tf.Tensor): The zero-indexed movie ids, as passed to the model.
+            movie_activations (tf.Tensor): The movie tower activations of all movies.
+
+        Returns:
+            tf.Tensor: The predicted ratings, one per pair.
+        """
+
+        movie_indices = self.lookup_movies(movie_ids)
+        movie_vector = tf.gather(movie_activations, movie_indices)
+
+        # Compute the user branch once per distinct user and broadcast it to the pairs
+        unique_user_ids, user_indices = tf.unique(user_ids)
+        user_vector = self.user_tower(unique_user_ids, training=False)
+        user_vector = tf.gather(user_vector, user_indices)
+
+        return tf.reshape(self.head(user_vector, movie_vector, training=False), [-1])
+
+    def predict_user(self, user_id: int, movie_ids: np.ndarray) -> np.ndarray:
+        """Predicts the ratings of one user for many movies, see predict_pairs.
+
+        Arguments:
+            user_id (int): The zero-indexed user id.
+            movie_ids (np.ndarray): The zero-indexed movie ids, as passed to the model.
+
+        Returns:
+            np.ndarray: The predicted ratings, one per movie.
+        """
+
+        movie_ids = np.asarray(movie_ids).flatten()
+
+        return self.predict_pairs(np.full_like(movie_ids, user_id), movie_ids)
+
     def add_user(self) -> None:
         """Adds a new user to the model. The new user vector is
         added as the average embedding weights of all the users.
         """
 
-        # Compute the average of the embedding weights and
-        # add it to the weights matrix
-        weights = self.user_embedding.get_weights()[0]
-        average_weight = np.mean(weights, axis=0)
-        new_weights = np.vstack([weights, average_weight])
+        if _add_user(self, ["user_embedding"]):
+            # The compiled function still uses the replaced layer
+            self.score_function = None
+
+
+class RetrievalModel(tf.keras.Model):
+    """Biased matrix factorization model used to retrieve candidate movies for a user.
+    The score of a movie is the dot product of the user and movie embeddings plus biases,
+    so the best movies of a user can be found with a single matrix-vector product over
+    all movies. The candidates are then re-ranked by the Recommender.
+    """
+
+    def __init__(
+        self,
+        embedding_dim: int,
+        num_users: int,
+        movie_ids: list,
+    ) -> None:
+        """Initializes the retrieval model.
+
+        Arguments:
+            embedding_dim (int): The size of the embedding vectors.
+            num_users (int): The number of users in the dataset.
+            movie_ids (list): All movie ids as a list of integers.
+        """
+
+        super(RetrievalModel, self).__init__()
+
+        self.num_users = num_users
+        self.embedding_dim = embedding_dim
+        self.movie_ids = np.asarray(movie_ids)
+
+        # Index 0 is reserved for unknown movies
+        self.movie_lookup = tf.keras.layers.IntegerLookup(vocabulary=list(movie_ids))
+
+        # Have at least num_users rows, rows of new users are added by add_user
+        self.user_embedding = tf.keras.layers.Embedding(num_users, embedding_dim)
+        self.user_bias = tf.keras.layers.Embedding(num_users, 1)
+        # Average embedding and bias of the known users, assigned to new users
+        self.average_user_rows = None
+        self.movie_embedding = tf.keras.layers.Embedding(
+            len(movie_ids) + 1, embedding_dim
+        )
+        self.movie_bias = tf.keras.layers.Embedding(len(movie_ids) + 1, 1)
+        self.global_bias = tf.Variable(0.0)
+
+        # Movie embeddings with the movie biases as last column, cached per weight load
+        self.movie_matrix = None
+
+    def call(self, inputs, training=True) -> tf.Tensor:
+        """Performs forward pass on the model.
+
+        Arguments:
+            inputs (tf.Tensor): The input tensor containing the user and movie ids,
+                as for the Recommender.
+            training (bool): Whether or not the model is currently training.
+
+        Returns:
+            output (tf.Tensor): The output tensor containing the predicted ratings.
+        """
+
+        user_ids = inputs[:, 0]
+        # The Recommender inputs contain the movie ids minus 1
+        movie_indices = self.movie_lookup(inputs[:, 1] + 1)
+
+        score = tf.reduce_sum(
+            self.user_embedding(user_ids) * self.movie_embedding(movie_indices),
+            axis=1,
+            keepdims=True,
+        )
+        score += self.user_bias(user_ids) + self.movie_bias(movie_indices)
+
+        return tf.sigmoid(score + self.global_bias)
+
+    def load_weights(self, filepath, *args, **kwargs):
+        """Loads the model weights and invalidates the cached movie matrix.
+        Takes the same arguments as tf.keras.Model.load_weights.
+        """
+
+        _match_checkpoint_capacity(self, filepath, ["user_embedding", "user_bias"])
+
+        status = super().load_weights(filepath, *args, **kwargs)
+        self.movie_matrix = None
+        self.average_user_rows = None
+
+        return status
+
+    def retrieve(
+        self, user_id: int, num_candidates: int, exclude_movie_ids: np.ndarray
+    ) -> np.ndarray:
+        """Retrieves the movies with the highest scores for a user by brute force,
+        i.e. a single BLAS matrix-vector product over all movies.
+
+        Arguments:
+            user_id (int): The zero-indexed user id.
+            num_candidates (int): The number of movies to retrieve.
+            exclude_movie_ids (np.ndarray): The movie ids that must not be retrieved,
+                e.g. rated movies.
+
+        Returns:
+            np.ndarray: The retrieved movie ids (not zero-indexed), in no particular order.
+        """
+
+        movie_matrix = self.movie_matrix
+        if movie_matrix is None:
+            # Skip the row of unknown movies
+            movie_matrix = np.hstack(
+                [
+                    self.movie_embedding.embeddings.numpy()[1:],
+                    self.movie_bias.embeddings.numpy()[1:],
+                ]
+            )
+            self.movie_matrix = movie_matrix
+
+        # The user and global biases are the same for all movies and do not change the ranking
+        user_vector = np.append(self.user_embedding.embeddings[user_id].numpy(), 1.0)
+        scores = movie_matrix @ user_vector
+
+        scores[np.isin(self.movie_ids, exclude_movie_ids)] = -np.inf
+
+        num_candidates = min(num_candidates, len(scores) - 1)
+        candidates = np.argpartition(-scores, num_candidates)[:num_candidates]
+
+        return self.movie_ids[candidates[np.isfinite(scores[candidates])]]
+
+    def add_user(self) -> None:
+        """Adds a new user to the model. The new user vector and bias are
+        added as the average embedding weights and bias of all the users.
+        """
+
+        _add_user(self, ["user_embedding", "user_bias"])
+
+
+class ALSRecommender:
+    """Biased matrix factorization model trained with alternating least squares (ALS) on a sparse
+    ratings matrix, a fast alternative to the Recommender. A rating is predicted as the global
+    average plus the user and movie biases plus the dot product of the user and movie factors.
+
+    It has the same scoring interface as the Recommender (predict_pairs, predict_user, add_user)
+    and also predicts ratings divided by 5. The user factors have the user bias as last column,
+    the movie factors the movie bias.
+    """
+
+    def __init__(
+        self,
+        num_factors: int,
+        regularization: float,
+        num_users: int,
+        movie_ids: list,
+    ) -> None:
+        """Initializes the ALS model.
+
+        Arguments:
+            num_factors (int): The number of latent factors of users and movies.
+            regularization (float): The L2 regularization of the factors and biases.
+            num_users (int): The number of users in the dataset.
+            movie_ids (list): All movie ids as a list of integers.
+        """
+
+        self.num_factors = num_factors
+        self.regularization = regularization
+        self.num_users = num_users
+        self.movie_ids = np.asarray(movie_ids)
+
+        # Dense table mapping every movie id to its row, the last row is reserved for unknown movies
+        self.movie_index_table = np.full(
+            self.movie_ids.max() + 2, len(self.movie_ids), dtype=np.int64
+        )
+        self.movie_index_table[self.movie_ids] = np.arange(len(self.movie_ids))
+
+        # Has at least num_users rows, rows of new users are added by add_user
+        random = np.random.default_rng()
+        self.user_factors = random.normal(0, 0.01, (num_users, num_factors + 1)).astype(
+            np.float32
+        )
+        self.movie_factors = random.normal(
+            0, 0.01, (len(self.movie_ids) + 1, num_factors + 1)
+        ).astype(np.float32)
+        self.user_factors[:, -1] = 0
+        self.movie_factors[:, -1] = 0
+        self.movie_factors[-1] = 0
+        self.global_bias = 0.0
+
+        # Average factors of the known users, assigned to new users
+        self.average_user_row = None
+
+    def movie_rows(self, movie_ids: np.ndarray) -> np.ndarray:
+        """Maps zero-indexed movie ids to rows of the movie factors.
+
+        Arguments:
+            movie_ids (np.ndarray): The zero-indexed movie ids, as passed to the model.
+
+        Returns:
+            np.ndarray: The rows of the movies.
+        """
+
+        movie_ids = np.asarray(movie_ids, dtype=np.int64) + 1
+
+        return self.movie_index_table[
+            np.clip(movie_ids, 0, len(self.movie_index_table) - 1)
+        ]
+
+    def _solve(
+        self,
+        targets: scipy.sparse.csr_matrix,
+        features: np.ndarray,
+        solution: np.ndarray,
+        num_steps: int,
+        block_size: int = 1 << 20,
+    ) -> None:
+        """Solves the regularized least squares problems of all rows of targets at once with a
+        few conjugate gradient steps, warm-started from the current solution. Rows are processed
+        in blocks of about block_size ratings to bound the memory usage.
+
+        Arguments:
+            targets (scipy.sparse.csr_matrix): The targets, one row per solved user or movie.
+            features (np.ndarray): The fixed features, one row per column of targets.
+            solution (np.ndarray): The solution, one row per row of targets, updated in place.
+            num_steps (int): The number of conjugate gradient steps.
+            block_size (int): The approximate number of ratings per block.
+        """
+
+        num_rows = targets.shape[0]
+        rows_per_block = max(1, num_rows * block_size // max(targets.nnz, 1))
+
+        for start in range(0, num_rows, rows_per_block):
+            block = targets[start : start + rows_per_block]
+            rating_rows = np.repeat(np.arange(block.shape[0]), np.diff(block.indptr))
+            rating_features = features[block.indices]
+
+            def product(vectors: np.ndarray) -> np.ndarray:
+                # (F^T F + regularization * I) v, with F the features of the rated columns of a row
+                dots = np.einsum("ij,ij->i", vectors[rating_rows], rating_features)
+                ratings = scipy.sparse.csr_matrix(
+                    (dots, block.indices, block.indptr), shape=block.shape
+                )
+                return ratings @ features + self.regularization * vectors
+
+            x = solution[start : start + rows_per_block]
+            residual = block @ features - product(x)
+            direction = residual.copy()
+            residual_norm = np.einsum("ij,ij->i", residual, residual)
 
+            for _ in range(num_steps):
+                product_direction = product(direction)
+                alpha = residual_norm / np.maximum(
+                    np.einsum("ij,ij->i", direction, product_direction), 1e-12
+                )
+                x += alpha[:, np.newaxis] * direction
+                residual -= alpha[:, np.newaxis] * product_direction
+
+                new_residual_norm = np.einsum("ij,ij->i", residual, residual)
+                beta = new_residual_norm / np.maximum(residual_norm, 1e-12)
+                direction = residual + beta[:, np.newaxis] * direction
+                residual_norm = new_residual_norm
+
+    def fit(
+        self,
+        user_ids: np.ndarray,
+        movie_ids: np.ndarray,
+        ratings: np.ndarray,
+        iterations: int = 15,
+        num_steps: int = 3,
+    ) -> None:
+        """Trains the model by alternately solving the user and the movie factors.
+
+        Arguments:
+            user_ids (np.ndarray): The zero-indexed user ids.
+            movie_ids (np.ndarray): The zero-indexed movie ids, as passed to the model.
+            ratings (np.ndarray): The ratings (0.5 - 5).
+            iterations (int): The number of alternations.
+            num_steps (int): The number of conjugate gradient steps per solve.
+        """
+
+        self.global_bias = float(np.mean(ratings))
+
+        users = scipy.sparse.csr_matrix(
+            (
+                (ratings - self.global_bias).astype(np.float32),
+                (user_ids, self.movie_rows(movie_ids)),
+            ),
+            shape=(len(self.user_factors), len(self.movie_factors)),
+        )
+        movies = users.T.tocsr()
+
+        for _ in range(iterations):
+            # The movie bias is moved to the targets, the user bias is
+            # the coefficient of a constant movie feature
+            targets = users.copy()
+            targets.data -= self.movie_factors[targets.indices, -1]
+            features = self.movie_factors.copy()
+            features[:, -1] = 1
+            self._solve(targets, features, self.user_factors, num_steps)
+
+            targets = movies.copy()
+            targets.data -= self.user_factors[targets.indices, -1]
+            features = self.user_factors.copy()
+            features[:, -1] = 1
+            self._solve(targets, features, self.movie_factors, num_steps)
+
+        # Unknown movies only get the global and user biases
+        self.movie_factors[-1] = 0
+        self.average_user_row = None
+
+    def predict_pairs(
+        self, user_ids: np.ndarray, movie_ids: np.ndarray, batch_size: int = 65536
+    ) -> np.ndarray:
+        """Predicts the ratings of many (user, movie) pairs.
+
+        Arguments:
+            user_ids (np.ndarray): The zero-indexed user ids.
+            movie_ids (np.ndarray): The zero-indexed movie ids, as passed to the model.
+            batch_size (int): The maximum number of pairs predicted at once.
+
+        Returns:
+            np.ndarray: The predicted ratings divided by 5, one per pair.
+        """
+
+        user_ids = np.asarray(user_ids, dtype=np.int64).flatten()
+        movie_rows = self.movie_rows(movie_ids).flatten()
+        user_factors = self.user_factors
+
+        predictions = []
+        for start in range(0, len(user_ids), batch_size):
+            users = user_factors[user_ids[start : start + batch_size]]
+            movies = self.movie_factors[movie_rows[start : start + batch_size]]
+            predictions.append(
+                self.global_bias
+                + np.einsum("ij,ij->i", users[:, :-1], movies[:, :-1])
+                + users[:, -1]
+                + movies[:, -1]
+            )
+
+        if not predictions:
+            return np.empty(0, dtype=np.float32)
+
+        return (np.clip(np.concatenate(predictions), 0.5, 5) / 5).astype(np.float32)
+
+    def predict_user(self, user_id: int, movie_ids: np.ndarray) -> np.ndarray:
+        """Predicts the ratings of one user for many movies with a single matrix-vector product.
+
+        Arguments:
+            user_id (int): The zero-indexed user id.
+            movie_ids (np.ndarray): The zero-indexed movie ids, as passed to the model.
+
+        Returns:
+            np.ndarray: The predicted ratings divided by 5, one per movie.
+        """
+
+        user = self.user_factors[user_id]
+        movies = self.movie_factors[self.movie_rows(movie_ids).flatten()]
+
+        # The last movie column is the movie bias, multiplied by 1
+        predictions = movies @ np.append(user[:-1], np.float32(1))
+        predictions += self.global_bias + user[-1]
+
+        return (np.clip(predictions, 0.5, 5) / 5).astype(np.float32)
+
+    def add_user(self) -> None:
+        """Adds a new user to the model. The new user factors and bias are the average of all
+        users. The factors are preallocated with spare rows and their capacity is doubled
+        if they are full, so adding a user takes constant amortized time.
+        """
+
+        if self.average_user_row is None:
+            self.average_user_row = self.user_factors[: self.num_users].mean(axis=0)
+
+        user_factors = self.user_factors
+        if self.num_users >= len(user_factors):
+            user_factors = np.zeros(
+                (2 * max(self.num_users, 1), user_factors.shape[1]), dtype=np.float32
+            )
+            user_factors[: self.num_users] = self.user_factors[: self.num_users]
+
+        user_factors[self.num_users] = self.average_user_row
+        self.user_factors = user_factors
         self.num_users += 1
 
-        # Recreate the user_embedding layer with the new number of users
-        self.user_embedding = tf.keras.layers.Embedding(
-            self.num_users, self.embedding_dim
+    def save_weights(self, filepath: str) -> None:
+        """Saves the factors and the global bias.
+
+        Arguments:
+            filepath (str): The path of the weights, without the .npz extension.
+        """
+
+        np.savez(
+            f"{filepath}.npz",
+            user_factors=self.user_factors,
+            movie_factors=self.movie_factors,
+            global_bias=self.global_bias,
         )
 
-        # Initialize the layer and assign the new weights
-        self.user_embedding(0)
-        self.user_embedding.embeddings.assign(new_weights)
+    def load_weights(self, filepath: str) -> None:
+        """Loads the factors and the global bias.
+
+        Arguments:
+            filepath (str): The path of the weights, without the .npz extension.
+        """
+
+        with np.load(f"{filepath}.npz") as weights:
+            self.user_factors = weights["user_factors"]
+            self.movie_factors = weights["movie_factors"]
+            self.global_bias = float(weights["global_bias"])
+
+        self.average_user_row = None
+
+
+def read_weights_version() -> str:
+    """Reads the latest version of the model weights, which changes on every training.
+
+    Returns:
+        str: The weights version, empty for unversioned weights (saved directly in the weights dir).
+    """
+
+    if not os.path.exists(LATEST_WEIGHTS_FILE):
+        return ""
+
+    with open(LATEST_WEIGHTS_FILE) as file:
+        return file.read().strip()
+
+
+def weights_path(version: str, name: str) -> str:
+    """Gets the path of saved model weights.
+
+    Arguments:
+        version (str): The weights version, empty for unversioned weights.
+        name (str): The name of the weights, e.g. "recommender_weights".
+
+    Returns:
+        str: The path of the weights.
+    """
+
+    return f"weights/{version}/{name}" if version else f"weights/{name}"
+
+
+def read_weights_metadata(version: str) -> dict:
+    """Reads the metadata of a weights version: the number of users and the last rating ID
+    the weights were trained with, the engine ("neural" or "als"), the number of incremental
+    trainings since the last full training and the validation MAE of the weights and of the last
+    full training, and the ratings snapshot of the last full training. Versions without an engine
+    were trained by the neural engine.
+
+    Arguments:
+        version (str): The weights version.
+
+    Returns:
+        dict: The metadata, empty for unversioned weights and only the number of users for
+            versions saved before the metadata was added.
+    """
+
+    if not version:
+        return {}
+
+    # Versions saved before the metadata was added only store the number of users
+    if not os.path.exists(weights_path(version, "metadata.json")):
+        with open(weights_path(version, "num_users")) as file:
+            return {"num_users": int(file.read())}
+
+    with open(weights_path(version, "metadata.json")) as file:
+        return json.load(file)
+
+
+def can_fine_tune(metadata: dict) -> bool:
+    """Checks if weights can be fine-tuned, i.e. they were trained by the neural engine and the
+    ratings snapshot of their last full training still exists.
+
+    Arguments:
+        metadata (dict): The metadata of the weights, see read_weights_metadata.
+
+    Returns:
+        bool: Whether the weights can be fine-tuned.
+    """
+
+    return (
+        metadata.get("engine", "neural") == "neural"
+        and "snapshot" in metadata
+        and os.path.isdir(metadata["snapshot"])
+    )
+
+
+def grow_models(
+    recommender_model: Union[Recommender, ALSRecommender],
+    retrieval_model: Optional[RetrievalModel],
+    num_users: int,
+) -> None:
+    """Adds users to the models until they know num_users users,
+    e.g. users registered after the weights were trained.
+
+    Arguments:
+        recommender_model (Union[Recommender, ALSRecommender]): The recommender model.
+        retrieval_model (Optional[RetrievalModel]): The retrieval model.
+        num_users (int): The number of users the models should know.
+    """
+
+    while recommender_model.num_users < num_users:
+        recommender_model.add_user()
+    while retrieval_model is not None and retrieval_model.num_users < num_users:
+        retrieval_model.add_user()
+
+
+def _publish_weights(version: str, keep_versions: int) -> None:
+    """Atomically points the latest weights to a version and removes the oldest versions.
+
+    Arguments:
+        version (str): The new weights version.
+        keep_versions (int): The number of versions that are kept, so that a process
+            that is still loading a previous version does not lose its files.
+    """
+
+    with open(f"{LATEST_WEIGHTS_FILE}.tmp", "w") as file:
+        file.write(version)
+    os.replace(f"{LATEST_WEIGHTS_FILE}.tmp", LATEST_WEIGHTS_FILE)
+
+    versions = sorted(
+        (
+            entry
+            for entry in os.scandir("weights")
+            if entry.is_dir()
+            and (
+                os.path.exists(f"{entry.path}/metadata.json")
+                or os.path.exists(f"{entry.path}/num_users")
+            )
+        ),
+        key=lambda entry: entry.stat().st_mtime,
+        reverse=True,
+    )
+    for entry in versions[keep_versions:]:
+        if entry.name != version:
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+
+def _max_rating_id() -> int:
+    """Gets the ID of the last rating. Ratings are added with increasing IDs, so the
+    ratings added after a training are those with a larger ID.
+
+    Returns:
+        int: The ID of the last rating, 0 if there are no ratings.
+    """
+
+    return db.session.execute(text("SELECT max(id) FROM movie_ratings")).scalar() or 0
+
+
+def _save_version(
+    version: str,
+    models: dict,
+    metadata: dict,
+    keep_versions: int,
+) -> None:
+    """Saves the weights of the trained models and their metadata as a version and publishes it.
+
+    Arguments:
+        version (str): The new weights version.
+        models (dict): The trained models by the name of their weights, e.g. "recommender_weights".
+        metadata (dict): The metadata of the weights, see read_weights_metadata.
+        keep_versions (int): The number of weights versions that are kept.
+    """
+
+    os.makedirs(f"weights/{version}")
+    for name, model in models.items():
+        model.save_weights(weights_path(version, name))
+
+    with open(weights_path(version, "metadata.json"), "w") as file:
+        json.dump(metadata, file)
+
+    _publish_weights(version, keep_versions)
+
+
+def export_ratings_snapshot(
+    snapshots_dir: str = SNAPSHOT_DIR,
+    keep_snapshots: int = 2,
+    chunk_size: int = 1000000,
+) -> str:
+    """Exports all ratings with a single SQL query to a columnar snapshot of .npy files
+    (user ids, movie ids and ratings). The rows are stored in random order, so that contiguous
+    slices of the snapshot are random samples. Every export is a new snapshot dir, which is
+    written completely before it is renamed to its final name, so readers never see a mix of
+    two exports.
+
+    Arguments:
+        snapshots_dir (str): The dir the snapshot dirs are written to.
+        keep_snapshots (int): The number of snapshots that are kept, the older ones are deleted.
+        chunk_size (int): The number of rows fetched from the database at once.
+
+    Returns:
+        str: The dir of the new snapshot.
+    """
+
+    user_ids, movie_ids, ratings = [], [], []
+
+    # Use the DBAPI cursor directly, converting plain tuples to arrays is much faster than rows
+    cursor = db.session.connection().connection.cursor()
+    cursor.execute("SELECT user_id, movie_id, rating FROM movie_ratings")
+    while rows := cursor.fetchmany(chunk_size):
+        chunk = np.array(rows, dtype=np.float64)
+        user_ids.append(chunk[:, 0].astype(np.int32))
+        movie_ids.append(chunk[:, 1].astype(np.int32))
+        ratings.append(chunk[:, 2].astype(np.float32))
+    cursor.close()
 
-        self.save_weights("weights/recommender_weights")
+    permutation = np.random.permutation(sum(len(chunk) for chunk in ratings))
+
+    snapshot_dir = f"{snapshots_dir}/{uuid.uuid4().hex}"
+    os.makedirs(f"{snapshot_dir}.tmp")
+    for name, column in [
+        ("user_ids", user_ids),
+        ("movie_ids", movie_ids),
+        ("ratings", ratings),
+    ]:
+        column = np.concatenate(column) if column else np.empty(0)
+        np.save(f"{snapshot_dir}.tmp/{name}.npy", column[permutation])
+    os.rename(f"{snapshot_dir}.tmp", snapshot_dir)
+
+    # Delete the oldest complete snapshots, unfinished ones belong to a running export
+    snapshots = sorted(
+        (
+            f"{snapshots_dir}/{name}"
+            for name in os.listdir(snapshots_dir)
+            if not name.endswith(".tmp")
+        ),
+        key=os.path.getmtime,
+    )
+    for snapshot in snapshots[:-keep_snapshots]:
+        shutil.rmtree(snapshot, ignore_errors=True)
 
+    return snapshot_dir
 
-def build_dataset(split: float) -> (tf.data.Dataset, tf.data.Dataset, list, list):
-    """Builds the dataset for the recommender model.
+
+def build_dataset(
+    snapshot_dir: str, split: float, batch_size: int, shuffle_block: int = 64
+) -> (tf.data.Dataset, tf.data.Dataset):
+    """Builds the batched datasets for the recommender model from a ratings snapshot.
+    The snapshot is memory-mapped and streamed in blocks, i.e. it is never loaded as a whole.
+    In every epoch the order of the training blocks is shuffled and the rows within every block
+    are permuted before it is split into batches, so the batches differ between epochs.
 
     Arguments:
+        snapshot_dir (str): The dir of the snapshot returned by export_ratings_snapshot.
         split (float): The train test split ratio.
+        batch_size (int): The batch size.
+        shuffle_block (int): The number of training batches whose rows are shuffled together.
 
     Returns:
         train_data (tf.data.Dataset): The training dataset.
         test_data (tf.data.Dataset): The testing dataset.
     """
 
-    train_data = []
+    user_ids = np.load(f"{snapshot_dir}/user_ids.npy", mmap_mode="r")
+    movie_ids = np.load(f"{snapshot_dir}/movie_ids.npy", mmap_mode="r")
+    ratings = np.load(f"{snapshot_dir}/ratings.npy", mmap_mode="r")
 
-    movie_ratings = MovieRatings.query.all()
+    def read_rows(
+        start: np.int64, end: np.int64, shuffle: bool
+    ) -> (np.ndarray, np.ndarray):
+        # Subtract 1 from user_id and movie_id to make them zero-indexed
+        inputs = np.stack([user_ids[start:end], movie_ids[start:end]], axis=1) - 1
+        targets = ratings[start:end] / np.float32(5)
+        if shuffle:
+            permutation = np.random.permutation(len(targets))
+            inputs, targets = inputs[permutation], targets[permutation]
+        return inputs.astype(np.int64), targets
 
-    random.shuffle(movie_ratings)
+    def read(start: tf.Tensor, end: tf.Tensor, shuffle: bool) -> (tf.Tensor, tf.Tensor):
+        inputs, targets = tf.numpy_function(
+            read_rows, [start, end, shuffle], [tf.int64, tf.float32]
+        )
+        return tf.ensure_shape(inputs, [None, 2]), tf.ensure_shape(targets, [None])
 
-    input_data = []
-    target_data = []
+    def split_block(inputs: tf.Tensor, targets: tf.Tensor) -> tf.data.Dataset:
+        return tf.data.Dataset.range(0, tf.size(targets, tf.int64), batch_size).map(
+            lambda start: (
+                inputs[start : start + batch_size],
+                targets[start : start + batch_size],
+            )
+        )
 
-    for row in movie_ratings:
-        # Subtract 1 from user_id and movie_id to make them zero-indexed
-        input_data.append([row.user_id - 1, row.movie_id - 1])
-        target_data.append(row.rating / 5)
+    num_train = int(len(ratings) * split)
+    block_size = shuffle_block * batch_size
 
-    train_data = tf.data.Dataset.from_tensor_slices(
-        (
-            input_data[: int(len(input_data) * split)],
-            target_data[: int(len(input_data) * split)],
+    train_data = (
+        tf.data.Dataset.range(0, num_train, block_size)
+        .shuffle(num_train // block_size + 1, reshuffle_each_iteration=True)
+        .map(
+            lambda start: read(start, tf.minimum(start + block_size, num_train), True),
+            num_parallel_calls=tf.data.AUTOTUNE,
+            deterministic=False,
         )
+        .flat_map(split_block)
+        .prefetch(tf.data.AUTOTUNE)
     )
-    test_data = tf.data.Dataset.from_tensor_slices(
-        (
-            input_data[int(len(input_data) * split) :],
-            target_data[int(len(input_data) * split) :],
+    # The test batches are the same in every epoch
+    test_data = (
+        tf.data.Dataset.range(num_train, len(ratings), batch_size)
+        .map(
+            lambda start: read(
+                start, tf.minimum(start + batch_size, len(ratings)), False
+            ),
+            num_parallel_calls=tf.data.AUTOTUNE,
         )
+        .cache()
+        .prefetch(tf.data.AUTOTUNE)
     )
 
     return train_data, test_data
@@ -179,8 +1189,13 @@ def train_model(
     num_users,
     num_movies,
     movie_vocab,
-) -> None:
-    """Trains the recommender model.
+    retrieval_embedding_dim=64,
+    validation_steps=50,
+    keep_versions=3,
+) -> str:
+    """Trains the recommender model and the retrieval model. The weights are saved as a new
+    version, which is published once both models are saved, so that a serving process never
+    loads partially written weights.
 
     Arguments:
         hidden_size (int): The number of nodes in each hidden layer.
@@ -192,9 +1207,19 @@ def train_model(
         num_users (int): The number of users in the dataset.
         num_movies (int): The number of movies in the dataset.
         movie_vocab (list): All movie ids as a list of strings.
+        retrieval_embedding_dim (int): The size of the embedding vectors of the retrieval model.
+        validation_steps (int): The number of validation batches the stored MAE is computed on,
+            the same batches fine_tune_model evaluates on.
+        keep_versions (int): The number of weights versions that are kept.
+
+    Returns:
+        str: The new weights version.
     """
 
-    train_data, test_data = build_dataset(0.8)
+    # Ratings added during the export are trained on again by the next incremental training
+    max_rating_id = _max_rating_id()
+    snapshot_dir = export_ratings_snapshot()
+    train_data, test_data = build_dataset(snapshot_dir, 0.8, batch_size)
 
     model = Recommender(
         hidden_size=hidden_size,
@@ -214,9 +1239,294 @@ def train_model(
     )
 
     model.fit(
-        train_data.shuffle(100000).batch(batch_size),
+        train_data,
         epochs=epochs,
-        validation_data=test_data.batch(batch_size),
+        validation_data=test_data,
+    )
+
+    retrieval_model = RetrievalModel(
+        embedding_dim=retrieval_embedding_dim,
+        num_users=num_users,
+        movie_ids=[int(movie_id) for movie_id in movie_vocab],
+    )
+
+    retrieval_model.compile(
+        optimizer=tf.keras.optimizers.Adam(learning_rate=learning_rate),
+        loss=tf.keras.losses.MeanSquaredError(),
+        metrics=[tf.keras.metrics.MeanAbsoluteError()],
+    )
+
+    retrieval_model.fit(
+        train_data,
+        epochs=epochs,
+        validation_data=test_data,
+    )
+
+    val_mae = model.evaluate(
+        test_data.take(validation_steps), return_dict=True, verbose=0
+    )["mean_absolute_error"]
+
+    version = uuid.uuid4().hex
+    _save_version(
+        version,
+        {"recommender_weights": model, "retrieval_weights": retrieval_model},
+        {
+            "engine": "neural",
+            "num_users": num_users,
+            "max_rating_id": max_rating_id,
+            "fine_tunes": 0,
+            "val_mae": val_mae,
+            "full_val_mae": val_mae,
+            "snapshot": snapshot_dir,
+        },
+        keep_versions,
+    )
+
+    return version
+
+
+def fine_tune_model(
+    hidden_size,
+    embedding_dim,
+    dropout,
+    batch_size,
+    learning_rate,
+    epochs,
+    num_users,
+    num_movies,
+    movie_vocab,
+    retrieval_embedding_dim=64,
+    replay_ratio=4,
+    max_steps=200,
+    validation_steps=50,
+    keep_versions=3,
+) -> str:
+    """Incrementally trains the latest weights on the ratings added since they were trained,
+    instead of training new models on all ratings. The user embeddings are grown for new users.
+    To not forget the older ratings, every new rating is mixed with replay_ratio random ratings
+    of the training split of the last full training's snapshot. The number of steps is bounded by
+    max_steps, so the duration does not depend on the size of the dataset.
+
+    The validation MAE before and after the fine-tuning and of the last full training are
+    computed on the same first batches of the validation split of the full training's snapshot.
+    Ratings that were changed (not added) since the last training are only trained on by the next
+    full training.
+
+    Arguments:
+        hidden_size (int): The number of nodes in each hidden layer.
+        embedding_dim (int): The size of the embedding vectors.
+        dropout (float): The dropout rate.
+        batch_size (int): The batch size.
+        learning_rate (float): The learning rate.
+        epochs (int): The number of passes over the new and replayed ratings.
+        num_users (int): The number of users in the dataset.
+        num_movies (int): The number of movies in the dataset.
+        movie_vocab (list): All movie ids as a list of strings.
+        retrieval_embedding_dim (int): The size of the embedding vectors of the retrieval model.
+        replay_ratio (int): The number of replayed ratings per new rating.
+        max_steps (int): The maximum number of training steps.
+        validation_steps (int): The number of validation batches the MAE is computed on.
+        keep_versions (int): The number of weights versions that are kept.
+
+    Returns:
+        str: The new weights version, the latest version if there are no new ratings.
+
+    Raises:
+        ValueError: If the latest weights are unversioned, were trained by the ALS engine or the
+            snapshot of their full training was deleted, i.e. they need a full training first.
+    """
+
+    base_version = read_weights_version()
+    metadata = read_weights_metadata(base_version)
+    if not can_fine_tune(metadata):
+        raise ValueError(
+            "Incremental training requires versioned weights of the neural engine "
+            "and the snapshot of their full training"
+        )
+
+    max_rating_id = _max_rating_id()
+
+    cursor = db.session.connection().connection.cursor()
+    cursor.execute(
+        "SELECT user_id, movie_id, rating FROM movie_ratings WHERE id > ? AND id <= ?",
+        (metadata["max_rating_id"], max_rating_id),
+    )
+    new_ratings = np.array(cursor.fetchall(), dtype=np.float64).reshape(-1, 3)
+    cursor.close()
+
+    if len(new_ratings) == 0:
+        print("No new ratings since the last training.")
+        return base_version
+
+    # Replay random ratings of the training split, the validation split stays unseen
+    user_ids = np.load(f"{metadata['snapshot']}/user_ids.npy", mmap_mode="r")
+    movie_ids = np.load(f"{metadata['snapshot']}/movie_ids.npy", mmap_mode="r")
+    ratings = np.load(f"{metadata['snapshot']}/ratings.npy", mmap_mode="r")
+    num_train = int(len(ratings) * 0.8)
+    replay = np.sort(
+        np.random.choice(
+            num_train, min(num_train, replay_ratio * len(new_ratings)), replace=False
+        )
+    )
+
+    # Subtract 1 from user_id and movie_id to make them zero-indexed
+    inputs = (
+        np.concatenate(
+            [
+                new_ratings[:, :2].astype(np.int64),
+                np.stack([user_ids[replay], movie_ids[replay]], axis=1),
+            ]
+        ).astype(np.int64)
+        - 1
+    )
+    targets = np.concatenate([new_ratings[:, 2], ratings[replay]]).astype(np.float32)
+
+    steps = min(max_steps, epochs * -(-len(targets) // batch_size))
+    train_data = (
+        tf.data.Dataset.from_tensor_slices((inputs, targets / 5))
+        .shuffle(len(targets))
+        .batch(batch_size)
+        .repeat()
+        .prefetch(tf.data.AUTOTUNE)
+    )
+    _, test_data = build_dataset(metadata["snapshot"], 0.8, batch_size)
+    test_data = test_data.take(validation_steps)
+
+    model = Recommender(
+        hidden_size=hidden_size,
+        embedding_dim=embedding_dim,
+        dropout=dropout,
+        num_users=metadata["num_users"],
+        num_movies=num_movies,
+        movie_vocab=movie_vocab,
+    )
+    model.load_weights(weights_path(base_version, "recommender_weights"))
+    model.build((None, 2))
+
+    retrieval_model = RetrievalModel(
+        embedding_dim=retrieval_embedding_dim,
+        num_users=metadata["num_users"],
+        movie_ids=[int(movie_id) for movie_id in movie_vocab],
+    )
+    retrieval_model(tf.zeros((1, 2), dtype=tf.int64), training=False)
+    retrieval_model.load_weights(weights_path(base_version, "retrieval_weights"))
+
+    grow_models(model, retrieval_model, num_users)
+
+    for trained_model in [model, retrieval_model]:
+        trained_model.compile(
+            optimizer=tf.keras.optimizers.Adam(learning_rate=learning_rate),
+            loss=tf.keras.losses.MeanSquaredError(),
+            metrics=[tf.keras.metrics.MeanAbsoluteError()],
+        )
+
+    previous_val_mae = model.evaluate(test_data, return_dict=True, verbose=0)[
+        "mean_absolute_error"
+    ]
+
+    model.fit(train_data, epochs=1, steps_per_epoch=steps)
+    retrieval_model.fit(train_data, epochs=1, steps_per_epoch=steps)
+
+    val_mae = model.evaluate(test_data, return_dict=True, verbose=0)[
+        "mean_absolute_error"
+    ]
+
+    # The MAE is computed on ratings divided by 5
+    print(
+        f"Fine-tuned on {len(new_ratings)} new and {len(replay)} replayed ratings "
+        f"in {steps} steps. Validation MAE: {previous_val_mae * 5:.4f} before, "
+        f"{val_mae * 5:.4f} after, {metadata['full_val_mae'] * 5:.4f} of the last full training."
+    )
+
+    version = uuid.uuid4().hex
+    _save_version(
+        version,
+        {"recommender_weights": model, "retrieval_weights": retrieval_model},
+        {
+            "engine": "neural",
+            "num_users": num_users,
+            "max_rating_id": max_rating_id,
+            "fine_tunes": metadata["fine_tunes"] + 1,
+            "val_mae": val_mae,
+            "full_val_mae": metadata["full_val_mae"],
+            "snapshot": metadata["snapshot"],
+        },
+        keep_versions,
+    )
+
+    return version
+
+
+def train_als_model(
+    num_factors,
+    regularization,
+    iterations,
+    num_users,
+    movie_vocab,
+    keep_versions=3,
+) -> str:
+    """Trains the ALS model on a snapshot of all ratings and publishes its weights as a new version.
+
+    Arguments:
+        num_factors (int): The number of latent factors of users and movies.
+        regularization (float): The L2 regularization of the factors and biases.
+        iterations (int): The number of alternations.
+        num_users (int): The number of users in the dataset.
+        movie_vocab (list): All movie ids as a list of strings.
+        keep_versions (int): The number of weights versions that are kept.
+
+    Returns:
+        str: The new weights version.
+    """
+
+    max_rating_id = _max_rating_id()
+    snapshot_dir = export_ratings_snapshot()
+
+    user_ids = np.load(f"{snapshot_dir}/user_ids.npy")
+    movie_ids = np.load(f"{snapshot_dir}/movie_ids.npy")
+    ratings = np.load(f"{snapshot_dir}/ratings.npy")
+    num_train = int(len(ratings) * 0.8)
+
+    model = ALSRecommender(
+        num_factors=num_factors,
+        regularization=regularization,
+        num_users=num_users,
+        movie_ids=[int(movie_id) for movie_id in movie_vocab],
+    )
+
+    # Subtract 1 from user_id and movie_id to make them zero-indexed
+    start_time = perf_counter()
+    model.fit(
+        user_ids[:num_train] - 1,
+        movie_ids[:num_train] - 1,
+        ratings[:num_train],
+        iterations=iterations,
+    )
+    train_seconds = perf_counter() - start_time
+
+    # The MAE is computed on ratings divided by 5, like the one of the neural engine
+    predictions = model.predict_pairs(
+        user_ids[num_train:] - 1, movie_ids[num_train:] - 1
+    )
+    val_mae = float(np.mean(np.abs(predictions - ratings[num_train:] / 5)))
+    print(
+        f"Trained the ALS model in {train_seconds:.1f} s. "
+        f"Validation MAE: {val_mae * 5:.4f}"
+    )
+
+    version = uuid.uuid4().hex
+    _save_version(
+        version,
+        {"als_weights": model},
+        {
+            "engine": "als",
+            "num_users": num_users,
+            "max_rating_id": max_rating_id,
+            "fine_tunes": 0,
+            "val_mae": val_mae,
+            "full_val_mae": val_mae,
+        },
+        keep_versions,
     )
 
-    model.save_weights("weights/recommender_weights")
+    return version
@@ -0,0 +1,153 @@
+import threading
+import numpy as np
+import flask_sqlalchemy
+from collections import OrderedDict, defaultdict
+from rapidfuzz import fuzz, process
+from models import Movie
+
+
+def _trigrams(text: str) -> set[str]:
+    """Gets the character trigrams of a text. The text is padded, so that short texts
+    and the start and end of a text are represented as well.
+
+    Arguments:
+        text (str): The lowercased text.
+
+    Returns:
+        set[str]: The trigrams.
+    """
+
+    padded = f"  {text} "
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+class TitleSearchIndex:
+    """Fuzzy search over the movie titles. A character trigram inverted index generates candidate
+    titles, which are then scored with a vectorised Levenshtein ratio. Results are cached per query.
+
+    The index is built from the database on the first search.
+    """
+
+    def __init__(
+        self,
+        threshold: float = 45,
+        max_candidates: int = 2000,
+        cache_size: int = 1024,
+    ) -> None:
+        """Initializes the TitleSearchIndex.
+
+        Arguments:
+            threshold (float): The minimum fuzzy ratio (0 - 100) of a matching title.
+            max_candidates (int): The maximum number of titles, sharing the most trigrams
+                with the query, that are scored.
+            cache_size (int): The number of queries whose results are cached.
+        """
+
+        self.threshold = threshold
+        self.max_candidates = max_candidates
+        self.cache_size = cache_size
+
+        self.movie_ids: np.ndarray = None
+        self.titles: list[str] = None
+        self.postings: dict[str, np.ndarray] = None
+
+        self.cache: OrderedDict[str, list[int]] = OrderedDict()
+        self.lock = threading.Lock()
+
+    def build(self, db: flask_sqlalchemy.extension.SQLAlchemy) -> None:
+        """Builds the trigram index from the titles of all movies and clears the result cache.
+
+        Arguments:
+            db (flask_sqlalchemy.extension.SQLAlchemy): The SQLAlchemy database object.
+        """
+
+        results = db.session.query(Movie.id, Movie.title).order_by(Movie.id).all()
+
+        titles = [title.lower() for _, title in results]
+        postings = defaultdict(list)
+        for position, title in enumerate(titles):
+            for trigram in _trigrams(title):
+                postings[trigram].append(position)
+
+        with self.lock:
+            self.movie_ids = np.asarray([movie_id for movie_id, _ in results])
+            self.titles = titles
+            self.postings = {
+                trigram: np.asarray(positions, dtype=np.int32)
+                for trigram, positions in postings.items()
+            }
+            self.cache.clear()
+
+    def _candidates(self, query: str) -> np.ndarray:
+        """Gets the positions of the titles that share the most trigrams with the query.
+
+        Arguments:
+            query (str): The lowercased query.
+
+        Returns:
+            np.ndarray: The positions of the candidate titles.
+        """
+
+        hits = [
+            self.postings[trigram]
+            for trigram in _trigrams(query)
+            if trigram in self.postings
+        ]
+        if not hits:
+            return np.empty(0, dtype=np.int32)
+
+        # Count the shared trigrams of every title
+        counts = np.bincount(np.concatenate(hits), minlength=len(self.titles))
+        candidates = np.flatnonzero(counts)
+
+        if len(candidates) > self.max_candidates:
+            top = np.argpartition(-counts[candidates], self.max_candidates)
+            candidates = candidates[top[: self.max_candidates]]
+
+        return candidates
+
+    def search(
+        self, db: flask_sqlalchemy.extension.SQLAlchemy, query: str
+    ) -> list[int]:
+        """Searches the movie titles.
+
+        Arguments:
+            db (flask_sqlalchemy.extension.SQLAlchemy): The SQLAlchemy database object.
+            query (str): The search query.
+
+        Returns:
+            list[int]: The IDs of the matching movies, sorted by fuzzy ratio.
+        """
+
+        if self.titles is None:
+            self.build(db)
+
+        query = query.strip().lower()
+
+        with self.lock:
+            if query in self.cache:
+                self.cache.move_to_end(query)
+                return self.cache[query]
+
+        candidates = self._candidates(query)
+
+        # Score all candidates at once
+        scores = process.cdist(
+            [query],
+            [self.titles[position] for position in candidates],
+            scorer=fuzz.ratio,
+            dtype=np.float32,
+        )[0]
+
+        matches = scores >= self.threshold
+        order = np.argsort(-scores[matches], kind="stable")
+        movie_ids = [
+            int(movie_id) for movie_id in self.movie_ids[candidates[matches][order]]
+        ]
+
+        with self.lock:
+            self.cache[query] = movie_ids
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+        return movie_ids
@@ -1,236 +1,598 @@
+import os
 import csv
-import requests
+import hmac
+import string
 import datetime
-import threading
+import itertools
 import flask_user
 import numpy as np
 import flask_sqlalchemy
-from collections import Counter
-from sqlalchemy.exc import IntegrityError
-from models import User, Movie, MovieGenre, MovieLinks, MovieTags, MovieRatings
+from typing import Iterator, Optional
+from sqlalchemy import insert, update, delete, select
+from time import perf_counter
+from sqlalchemy.orm import selectinload
+from flask_user import UserManager
+from passlib.context import CryptContext
+from concurrent.futures import ProcessPoolExecutor
+from movie_info_cache import MovieInfoCache
+from models import (
+    User,
+    Movie,
+    MovieGenre,
+    MovieLinks,
+    MovieTags,
+    MovieTagSummary,
+    MovieRatings,
+    UserRecommendation,
+)
+
+# Loader options for movies that are passed to get_movie_metadata. Loads the tag summaries
+# and links of all movies with one query each, instead of two queries per movie.
+METADATA_LOAD_OPTIONS = (selectinload(Movie.tag_summaries), selectinload(Movie.links))
+
+# Number of csv rows that are read, inserted and committed at once during the import
+IMPORT_CHUNK_SIZE = 50000
+
+# Imported users get their username as password. In the "placeholder" password mode, the
+# password is stored with this prefix instead of hashing it, and only hashed on first login.
+PLACEHOLDER_PASSWORD_PREFIX = "placeholder$"
+
+# Lowercases ASCII letters only, like the NOCASE collation of SQLite
+NOCASE_TRANSLATION = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+# Crypt context of the password hashing worker processes
+_worker_crypt_context = None
+
+
+def _init_hash_worker(crypt_context_config: str) -> None:
+    """Initializes a password hashing worker process with the crypt context of the UserManager.
+
+    Arguments:
+        crypt_context_config (str): The serialized passlib crypt context.
+    """
+
+    global _worker_crypt_context
+    _worker_crypt_context = CryptContext.from_string(crypt_context_config)
+
+
+def _hash_password(password: str) -> str:
+    """Hashes a password in a worker process.
+
+    Arguments:
+        password (str): The password to hash.
+
+    Returns:
+        str: The password hash.
+    """
+
+    return _worker_crypt_context.hash(password)
+
+
+class PlaceholderPasswordUserManager(UserManager):
+    """UserManager that accepts the placeholder passwords of imported users.
+    The placeholder is replaced by a real hash on first login, see hash_placeholder_password.
+    """
+
+    def verify_password(self, password: str, password_hash: str) -> bool:
+        """Verifies a password against a password hash or a placeholder password.
+
+        Arguments:
+            password (str): The plaintext password.
+            password_hash (str): The password hash or placeholder password.
+
+        Returns:
+            bool: Whether the password is correct.
+        """
+
+        if password_hash.startswith(PLACEHOLDER_PASSWORD_PREFIX):
+            return hmac.compare_digest(
+                password.encode("utf8"),
+                password_hash[len(PLACEHOLDER_PASSWORD_PREFIX) :].encode("utf8"),
+            )
+
+        return super().verify_password(password, password_hash)
+
+
+def hash_placeholder_password(
+    db: flask_sqlalchemy.extension.SQLAlchemy,
+    user_manager: flask_user.user_manager.UserManager,
+    user: User,
+) -> None:
+    """Replaces the placeholder password of an imported user with a real hash.
+
+    Arguments:
+        db (flask_sqlalchemy.extension.SQLAlchemy): The SQLAlchemy database object.
+        user_manager (flask_user.user_manager.UserManager): The UserManager object.
+        user (User): The user that just logged in.
+    """
+
+    if user.password.startswith(PLACEHOLDER_PASSWORD_PREFIX):
+        user.password = user_manager.hash_password(
+            user.password[len(PLACEHOLDER_PASSWORD_PREFIX) :]
+        )
+        db.session.commit()
+
+
+def _read_csv_chunks(
+    file_name: str, chunk_size: int = IMPORT_CHUNK_SIZE
+) -> Iterator[list]:
+    """Reads a csv file in chunks of rows, skipping the header.
+
+    Arguments:
+        file_name (str): The path of the csv file.
+        chunk_size (int): The number of rows per chunk.
+
+    Yields:
+        list: The next chunk of rows.
+    """
+
+    with open(file_name, newline="", encoding="utf8") as csvfile:
+        reader = csv.reader(csvfile, delimiter=",")
+        next(reader, None)
+
+        while chunk := list(itertools.islice(reader, chunk_size)):
+            yield chunk
+
+
+def _print_progress(name: str, count: int, start_time: float, end: str = "") -> None:
+    """Prints the number of imported rows and the import speed.
+
+    Arguments:
+        name (str): The name of the imported rows.
+        count (int): The number of rows imported so far.
+        start_time (float): The perf_counter value at the start of the import.
+        end (str): The string appended after the message.
+    """
+
+    rows_per_second = count / max(perf_counter() - start_time, 1e-9)
+    print(f"\r{count} {name} read ({rows_per_second:.0f} rows/sec)", end=end)
+
+
+def _bulk_insert(
+    db: flask_sqlalchemy.extension.SQLAlchemy,
+    model: type,
+    rows: list,
+    ignore_duplicates: bool = False,
+) -> None:
+    """Inserts rows with a single executemany, bypassing the ORM unit of work.
+
+    Arguments:
+        db (flask_sqlalchemy.extension.SQLAlchemy): The SQLAlchemy database object.
+        model (type): The model of the table to insert into.
+        rows (list): The rows as dictionaries of column values.
+        ignore_duplicates (bool): Whether to skip rows that violate a unique constraint.
+    """
+
+    if not rows:
+        return
+
+    statement = insert(model)
+    if ignore_duplicates:
+        statement = statement.prefix_with("OR IGNORE")
+
+    db.session.execute(statement, rows)
+
+
+class _UserIdMap:
+    """Maps the usernames of imported users to their ids and creates missing users in bulk.
+    Users get consecutive ids in the order they first appear, as the recommender model
+    uses the user ids as embedding indices.
+    """
+
+    def __init__(
+        self,
+        db: flask_sqlalchemy.extension.SQLAlchemy,
+        user_manager: flask_user.user_manager.UserManager,
+        password_mode: str = "parallel",
+    ) -> None:
+        """Initializes the map with all users that are already in the database.
+
+        Arguments:
+            db (flask_sqlalchemy.extension.SQLAlchemy): The SQLAlchemy database object.
+            user_manager (flask_user.user_manager.UserManager): The UserManager object.
+            password_mode (str): "parallel" hashes the passwords of new users in a pool of processes
+                across all cores, "placeholder" stores placeholder passwords that are hashed on first login.
+        """
+
+        self.db = db
+        self.user_manager = user_manager
+        self.password_mode = password_mode
+        self.user_ids = {
+            username: id for id, username in db.session.query(User.id, User.username)
+        }
+        self.next_id = max(self.user_ids.values(), default=0) + 1
+
+        if password_mode == "parallel":
+            self.executor = ProcessPoolExecutor(
+                initializer=_init_hash_worker,
+                initargs=(
+                    user_manager.password_manager.password_crypt_context.to_string(),
+                ),
+            )
+
+    def _passwords(self, usernames: list) -> list:
+        """Gets the passwords of new users, whose password is their username.
+
+        Arguments:
+            usernames (list): The usernames of the new users.
+
+        Returns:
+            list: The hashed or placeholder passwords.
+        """
+
+        if self.password_mode == "placeholder":
+            return [PLACEHOLDER_PASSWORD_PREFIX + username for username in usernames]
+
+        chunksize = max(1, len(usernames) // (4 * os.cpu_count()))
+
+        return list(self.executor.map(_hash_password, usernames, chunksize=chunksize))
+
+    def add_missing(self, usernames: list) -> None:
+        """Creates all users that don't exist yet with a single insert.
+
+        Arguments:
+            usernames (list): The usernames of a chunk of rows, may contain duplicates.
+        """
+
+        new_usernames = []
+
+        for username in usernames:
+            if username not in self.user_ids:
+                self.user_ids[username] = self.next_id
+                new_usernames.append(username)
+                self.next_id += 1
+
+        new_users = [
+            {"id": self.user_ids[username], "username": username, "password": password}
+            for username, password in zip(new_usernames, self._passwords(new_usernames))
+        ]
+
+        _bulk_insert(self.db, User, new_users)
+
+    def close(self) -> None:
+        """Shuts down the password hashing processes."""
+
+        if self.password_mode == "parallel":
+            self.executor.shutdown()
+
+    def __getitem__(self, username: str) -> int:
+        return self.user_ids[username]
 
 
 def check_and_read_data(
     db: flask_sqlalchemy.extension.SQLAlchemy,
     user_manager: flask_user.user_manager.UserManager,
+    password_mode: str = "parallel",
 ) -> None:
     """Reads data from movies, links, tags and ratings csv files and stores them in the database.
+    The files are read in chunks, every chunk is inserted with one executemany and committed as one transaction.
 
     Arguments:
         db (flask_sqlalchemy.extension.SQLAlchemy): The SQLAlchemy database object.
         user_manager (flask_user.user_manager.UserManager): The UserManager object.
+        password_mode (str): How the passwords of imported users are created, "parallel" or "placeholder".
     """
 
     # Check if we have movies in the database,
     # read data if database is empty
     if Movie.query.count() == 0:
+        start_time = perf_counter()
+        count = 0
+        titles = set()
+
         # Read movies from csv
-        with open("data/movies.csv", newline="", encoding="utf8") as csvfile:
-            reader = csv.reader(csvfile, delimiter=",")
-            count = 0
-
-            for row in reader:
-                if count > 0:
-                    try:
-                        id = row[0]
-                        title = row[1]
-                        # Year is always part of the title
-                        year = title[-5:-1]
-                        movie = Movie(id=id, title=title, year=year)
-                        db.session.add(movie)
-                        # Genres is a list of genres
-                        genres = row[2].split("|")
-
-                        for genre in genres:
-                            movie_genre = MovieGenre(movie_id=id, genre=genre)
-                            db.session.add(movie_genre)
-
-                        db.session.commit()
-
-                    except IntegrityError:
-                        print("\nIgnoring duplicate movie: " + title)
-                        db.session.rollback()
-                        pass
-
-                count += 1
-                if count % 100 == 0:
-                    print("\r" + str(count), " movies read", end="")
+        for chunk in _read_csv_chunks("data/movies.csv"):
+            movies = []
+            movie_genres = []
+
+            for row in chunk:
+                id = int(row[0])
+                title = row[1]
+
+                # Titles are unique, compared like the NOCASE collation of the column
+                nocase_title = title.translate(NOCASE_TRANSLATION)
+                if nocase_title in titles:
+                    print("\nIgnoring duplicate movie: " + title)
+                    continue
+                titles.add(nocase_title)
+
+                # Year is always part of the title
+                year = title[-5:-1]
+                movies.append({"id": id, "title": title, "year": year})
+                # Genres is a list of genres
+                for genre in row[2].split("|"):
+                    movie_genres.append({"movie_id": id, "genre": genre})
+
+            _bulk_insert(db, Movie, movies)
+            _bulk_insert(db, MovieGenre, movie_genres)
+            db.session.commit()
+
+            count += len(chunk)
+            _print_progress("movies", count, start_time)
 
         print("\nFinished reading in movies \n")
 
+    # Links, tags and ratings are only stored for movies that are in the database
+    movie_ids = {id for (id,) in db.session.query(Movie.id)}
+
     if MovieLinks.query.count() == 0:
-        with open("data/links.csv", newline="", encoding="utf8") as csvfile:
-            reader = csv.reader(csvfile, delimiter=",")
-            count = 0
-
-            for row in reader:
-                if count > 0:
-                    try:
-                        movie_id = row[0]
-                        imdb_id = row[1]
-                        tmdb_id = row[2]
-                        movie_link = MovieLinks(
-                            movie_id=movie_id, imdb_id=imdb_id, tmdb_id=tmdb_id
-                        )
-                        db.session.add(movie_link)
-                        db.session.commit()
-
-                    except IntegrityError:
-                        print("\nIgnoring duplicate movie link: " + movie_id)
-                        db.session.rollback()
-                        pass
-
-                count += 1
-                if count % 100 == 0:
-                    print("\r" + str(count), " movie links read", end="")
+        start_time = perf_counter()
+        count = 0
+
+        for chunk in _read_csv_chunks("data/links.csv"):
+            movie_links = [
+                {"movie_id": int(row[0]), "imdb_id": row[1], "tmdb_id": row[2]}
+                for row in chunk
+                if int(row[0]) in movie_ids
+            ]
+
+            # Duplicate links are ignored
+            _bulk_insert(db, MovieLinks, movie_links, ignore_duplicates=True)
+            db.session.commit()
+
+            count += len(chunk)
+            _print_progress("movie links", count, start_time)
 
         print("\nFinished reading in links \n")
 
+    user_ids = _UserIdMap(db, user_manager, password_mode)
+
     if MovieTags.query.count() == 0:
-        with open("data/tags.csv", newline="", encoding="utf8") as csvfile:
-            reader = csv.reader(csvfile, delimiter=",")
-            count = 0
-
-            for row in reader:
-                if count > 0:
-                    try:
-                        user_id = row[0]
-                        username = f"User{user_id}"
-                        query = User.query.filter_by(username=username)
-
-                        # Create a new user if the user doesn't exist in the database
-                        if query.count() == 0:
-                            user = User(
-                                username=username,
-                                password=user_manager.hash_password(username),
-                            )
-                            db.session.add(user)
-                            db.session.commit()
-                            user_id = user.id
-                        else:
-                            user_id = query.first().id
-
-                        movie_id = row[1]
-                        tag = row[2]
-                        timestamp = row[3]
-                        movie_tag = MovieTags(
-                            user_id=user_id,
-                            movie_id=movie_id,
-                            tag=tag,
-                            timestamp=datetime.date.fromtimestamp(int(timestamp)),
-                        )
-                        db.session.add(movie_tag)
-                        db.session.commit()
-
-                    except IntegrityError:
-                        print(
-                            "\nIntegrity error for tag: "
-                            + tag
-                            + " for movie: "
-                            + movie_id
-                            + " by user: "
-                            + user_id
-                        )
-                        db.session.rollback()
-                        pass
-
-                count += 1
-                if count % 100 == 0:
-                    print("\r" + str(count), " movie tags read", end="")
+        start_time = perf_counter()
+        count = 0
+
+        for chunk in _read_csv_chunks("data/tags.csv"):
+            chunk = [row for row in chunk if int(row[1]) in movie_ids]
+
+            # Create all users of the chunk that don't exist in the database yet
+            user_ids.add_missing([f"User{row[0]}" for row in chunk])
+
+            movie_tags = [
+                {
+                    "user_id": user_ids[f"User{row[0]}"],
+                    "movie_id": int(row[1]),
+                    "tag": row[2],
+                    "timestamp": datetime.date.fromtimestamp(int(row[3])),
+                }
+                for row in chunk
+            ]
+
+            # Duplicate tags of a user for a movie are ignored
+            _bulk_insert(db, MovieTags, movie_tags, ignore_duplicates=True)
+            db.session.commit()
+
+            count += len(chunk)
+            _print_progress("movie tags", count, start_time)
 
         print("\nFinished reading in tags \n")
 
-    dict_for_avg: dict[str, list] = {}
+    if MovieTagSummary.query.count() == 0:
+        print("Summarising movie tags...")
+
+        refresh_movie_tag_summaries(db)
+
+        print("Finished summarising movie tags \n")
 
     if MovieRatings.query.count() == 0:
-        with open("data/ratings.csv", newline="", encoding="utf8") as csvfile:
-            reader = csv.reader(csvfile, delimiter=",")
-            count = 0
-
-            for row in reader:
-                if count > 0:
-                    try:
-                        user_id = row[0]
-                        username = f"User{user_id}"
-                        query = User.query.filter_by(username=username)
-
-                        # Create a new user if the user doesn't exist in the database
-                        if query.count() == 0:
-                            user = User(
-                                username=username,
-                                password=user_manager.hash_password(username),
-                            )
-                            db.session.add(user)
-                            db.session.commit()
-                            user_id = user.id
-                        else:
-                            user_id = query.first().id
-
-                        movie_id = row[1]
-                        rating = row[2]
-                        timestamp = row[3]
-                        movie_rating = MovieRatings(
-                            user_id=user_id,
-                            movie_id=movie_id,
-                            rating=rating,
-                            timestamp=datetime.date.fromtimestamp(int(timestamp)),
-                        )
-                        db.session.add(movie_rating)
-
-                        # Sum ratings for each movie and count the number of ratings
-                        if movie_id in dict_for_avg:
-                            dict_for_avg[movie_id][0] += float(rating)
-                            dict_for_avg[movie_id][1] += 1
-                        else:
-                            dict_for_avg[movie_id] = [float(rating), 1]
-
-                        # Commit every 2000 rows
-                        if count % 2000 == 0:
-                            db.session.commit()
-                            print("\r" + str(count), " movie ratings read", end="")
-
-                    except IntegrityError:
-                        db.session.rollback()
-                        print(
-                            "\nIntegrity error for rating: "
-                            + rating
-                            + " for movie: "
-                            + movie_id
-                            + " by user: "
-                            + user_id
-                        )
-                        continue
-
-                count += 1
-
-            # Commit remaining rows
+        start_time = perf_counter()
+        count = 0
+
+        for chunk in _read_csv_chunks("data/ratings.csv"):
+            chunk = [row for row in chunk if int(row[1]) in movie_ids]
+
+            # Create all users of the chunk that don't exist in the database yet
+            user_ids.add_missing([f"User{row[0]}" for row in chunk])
+
+            movie_ratings = [
+                {
+                    "user_id": user_ids[f"User{row[0]}"],
+                    "movie_id": int(row[1]),
+                    "rating": float(row[2]),
+                    "timestamp": datetime.date.fromtimestamp(int(row[3])),
+                }
+                for row in chunk
+            ]
+
+            # Duplicate ratings of a user for a movie are ignored
+            _bulk_insert(db, MovieRatings, movie_ratings, ignore_duplicates=True)
             db.session.commit()
 
+            count += len(chunk)
+            _print_progress("movie ratings", count, start_time)
+
         print("\nFinished reading in ratings \n")
 
+    user_ids.close()
+
     print("Updating average ratings...")
 
-    # Update average ratings for each movie
-    for movie_id, (rating_sum, rating_count) in dict_for_avg.items():
-        movie = Movie.query.filter_by(id=movie_id).first()
-        if movie is not None:
-            movie.avg_rating = round(rating_sum / rating_count, 4)
-            movie.num_ratings = rating_count
-    db.session.commit()
+    refresh_movie_aggregates(db)
 
     print("Finished updating average ratings \n")
 
 
-def fetch_movie_info(movie_info_url: str, movie_id: int, session: requests.Session, movie_info_dict: dict):
-    """Fetches movie plot description from the OMDB API. This function is used in a thread.
-    
+def refresh_movie_aggregates(db: flask_sqlalchemy.extension.SQLAlchemy) -> None:
+    """Recomputes the average rating and number of ratings of all movies with a single
+    UPDATE ... FROM (SELECT ... GROUP BY movie_id) statement.
+
+    Arguments:
+        db (flask_sqlalchemy.extension.SQLAlchemy): The SQLAlchemy database object.
+    """
+
+    aggregates = (
+        db.session.query(
+            MovieRatings.movie_id,
+            db.func.avg(MovieRatings.rating).label("avg_rating"),
+            db.func.count(MovieRatings.id).label("num_ratings"),
+        )
+        .group_by(MovieRatings.movie_id)
+        .subquery()
+    )
+
+    db.session.execute(
+        update(Movie)
+        .where(Movie.id == aggregates.c.movie_id)
+        .values(
+            avg_rating=db.func.round(aggregates.c.avg_rating, 4),
+            num_ratings=aggregates.c.num_ratings,
+        )
+    )
+    db.session.commit()
+
+
+def refresh_movie_tag_summaries(
+    db: flask_sqlalchemy.extension.SQLAlchemy, movie_ids: Optional[list[int]] = None
+) -> None:
+    """Recomputes the tag summaries (normalised tag, count and rank) of movies from their tags
+    with a single INSERT ... SELECT statement. Has to be called whenever tags are written.
+
+    Arguments:
+        db (flask_sqlalchemy.extension.SQLAlchemy): The SQLAlchemy database object.
+        movie_ids (Optional[list[int]]): The IDs of the movies to refresh, all movies if None.
+    """
+
+    # Same normalisation as str.lower(), see set_sqlite_pragma
+    normalised_tag = db.func.unicode_lower(MovieTags.tag)
+    tag_count = db.func.count(MovieTags.id)
+
+    # Rank the tags of each movie by tag count first and then alphabetically
+    summaries = select(
+        MovieTags.movie_id,
+        normalised_tag,
+        tag_count,
+        db.func.row_number().over(
+            partition_by=MovieTags.movie_id,
+            order_by=(tag_count.desc(), normalised_tag),
+        ),
+    ).group_by(MovieTags.movie_id, normalised_tag)
+
+    delete_summaries = delete(MovieTagSummary)
+
+    if movie_ids is not None:
+        summaries = summaries.where(MovieTags.movie_id.in_(movie_ids))
+        delete_summaries = delete_summaries.where(
+            MovieTagSummary.movie_id.in_(movie_ids)
+        )
+
+    db.session.execute(delete_summaries)
+    db.session.execute(
+        insert(MovieTagSummary).from_select(
+            ["movie_id", "tag", "count", "rank"], summaries
+        )
+    )
+    db.session.commit()
+
+
+def update_movie_aggregates(
+    db: flask_sqlalchemy.extension.SQLAlchemy,
+    movie_id: int,
+    rating: float,
+    previous_rating: Optional[float] = None,
+) -> None:
+    """Incrementally updates the average rating and number of ratings of a movie after a rating
+    was added or changed. The update is part of the current transaction, i.e. it is committed
+    (or rolled back) together with the rating.
+
     Arguments:
-        movie_info_url (str): The movie info URL.
-        movie_id (int): The movie ID.
-        session (requests.Session): The requests session.
-        movie_info_dict (dict): The dictionary to store the movie info.
+        db (flask_sqlalchemy.extension.SQLAlchemy): The SQLAlchemy database object.
+        movie_id (int): The ID of the rated movie.
+        rating (float): The new rating.
+        previous_rating (Optional[float]): The previous rating if the rating was changed, None if it was added.
     """
-    movie_info_dict[movie_id] = session.get(movie_info_url).json()
+
+    if previous_rating is None:
+        values = {
+            Movie.avg_rating: (Movie.avg_rating * Movie.num_ratings + rating)
+            / (Movie.num_ratings + 1),
+            Movie.num_ratings: Movie.num_ratings + 1,
+        }
+    else:
+        values = {
+            Movie.avg_rating: Movie.avg_rating
+            + (rating - previous_rating) / db.func.max(Movie.num_ratings, 1),
+        }
+
+    db.session.execute(update(Movie).where(Movie.id == movie_id).values(values))
+
+
+def get_cached_recommendations(
+    db: flask_sqlalchemy.extension.SQLAlchemy, user_id: int, weights_version: str
+) -> Optional[dict[int, float]]:
+    """Gets the cached recommendations of a user, if they were computed with the current weights.
+
+    Arguments:
+        db (flask_sqlalchemy.extension.SQLAlchemy): The SQLAlchemy database object.
+        user_id (int): The ID of the user.
+        weights_version (str): The version of the currently loaded model weights.
+
+    Returns:
+        Optional[dict[int, float]]: The recommended movie IDs and their predicted ratings,
+            sorted by predicted rating, or None if there are no valid cached recommendations.
+    """
+
+    recommendations = (
+        db.session.query(UserRecommendation.movie_id, UserRecommendation.score)
+        .filter_by(user_id=user_id, weights_version=weights_version)
+        .order_by(UserRecommendation.score.desc())
+        .all()
+    )
+
+    if not recommendations:
+        return None
+
+    return dict(recommendations)
+
+
+def store_recommendations(
+    db: flask_sqlalchemy.extension.SQLAlchemy,
+    recommendations: dict[int, dict[int, float]],
+    weights_version: str,
+) -> None:
+    """Replaces the cached recommendations of users.
+
+    Arguments:
+        db (flask_sqlalchemy.extension.SQLAlchemy): The SQLAlchemy database object.
+        recommendations (dict[int, dict[int, float]]): The recommended movie IDs and their
+            predicted ratings for each user ID.
+        weights_version (str): The version of the model weights the recommendations were computed with.
+    """
+
+    db.session.execute(
+        delete(UserRecommendation).where(
+            UserRecommendation.user_id.in_(list(recommendations))
+        )
+    )
+    _bulk_insert(
+        db,
+        UserRecommendation,
+        [
+            {
+                "user_id": user_id,
+                "movie_id": movie_id,
+                "score": score,
+                "weights_version": weights_version,
+            }
+            for user_id, user_recommendations in recommendations.items()
+            for movie_id, score in user_recommendations.items()
+        ],
+    )
+    db.session.commit()
+
+
+def invalidate_recommendations(
+    db: flask_sqlalchemy.extension.SQLAlchemy, user_id: int
+) -> None:
+    """Removes the cached recommendations of a user, e.g. after the user rated a movie.
+    The removal is part of the current transaction.
+
+    Arguments:
+        db (flask_sqlalchemy.extension.SQLAlchemy): The SQLAlchemy database object.
+        user_id (int): The ID of the user.
+    """
+
+    db.session.execute(
+        delete(UserRecommendation).where(UserRecommendation.user_id == user_id)
+    )
 
 
 def get_movie_metadata(
@@ -238,16 +600,19 @@ def get_movie_metadata(
     movies: list,
     current_user: User,
     get_user_ratings: bool = True,
-    get_movie_plot: bool = True,
+    movie_info_cache: Optional[MovieInfoCache] = None,
 ) -> (dict, dict, dict):
     """Gets movie metadata from the database, i.e., tags, average ratings, and user ratings.
+    The movies should be queried with METADATA_LOAD_OPTIONS, so that their tags and links
+    are not loaded one movie at a time.
 
     Arguments:
         db (flask_sqlalchemy.extension.SQLAlchemy): The SQLAlchemy database object.
         movies (list): A list of Movie objects.
         current_user (User): The current user.
         get_user_ratings (bool): Whether to get ratings for the current user.
-        get_movie_plot (bool): Whether to get movie plot descriptions.
+        movie_info_cache (Optional[MovieInfoCache]): The cache to get movie plot descriptions from,
+            no plot descriptions are returned if None.
 
     Returns:
         movie_tags (dict): A dictionary of movie tags.
@@ -261,75 +626,41 @@ def get_movie_metadata(
     user_ratings = {}
     movie_plot_dict = {}
 
-    # Fetch all ratings for all movies in one go
-    all_ratings = (
-        db.session.query(
-            MovieRatings.movie_id,
-            db.func.avg(MovieRatings.rating),
-            db.func.count(MovieRatings.movie_id),
-        )
-        .group_by(MovieRatings.movie_id)
-        .all()
-    )
-
-    # Convert the result into a dictionary for easy access
-    all_ratings_dict = {movie_id: (avg, count) for movie_id, avg, count in all_ratings}
+    movie_ids = [movie.id for movie in movies]
 
     if get_user_ratings:
-        # Fetch all user ratings for all movies in one go
-        all_user_ratings = MovieRatings.query.filter_by(user_id=current_user.id).all()
+        # Fetch the user ratings for the displayed movies in one go
+        all_user_ratings = MovieRatings.query.filter(
+            MovieRatings.user_id == current_user.id,
+            MovieRatings.movie_id.in_(movie_ids),
+        ).all()
 
         # Convert the result into a dictionary for easy access
         all_user_ratings_dict = {
             rating.movie_id: rating.rating for rating in all_user_ratings
         }
 
-    # Create a list to hold all the threads 
-    # and a session for each thread
-    if get_movie_plot:
-        request_session = requests.Session()
-        threads = []
-
     for movie in movies:
-        # Get movie tags for each movie, sort them by tag count first and then alphabetically
-        if movie.tags:
-            tag_counts = Counter([tag.tag.lower() for tag in movie.tags])
-            sorted_tags = sorted(tag_counts.items(), key=lambda x: (-x[1], x[0]))
-            sorted_tags = [key.title() for key in dict(sorted_tags).keys()]
-            movie_tags[movie.id] = sorted_tags
-
-        # Get average rating for each movie
-        if movie.id in all_ratings_dict:
-            avg, count = all_ratings_dict[movie.id]
-            average_ratings[movie.id] = (round(avg, 1), count)
-        else:
-            average_ratings[movie.id] = (0.0, 0)
+        # Get movie tags for each movie, already sorted by tag count first and then alphabetically
+        if movie.tag_summaries:
+            movie_tags[movie.id] = [
+                summary.tag.title() for summary in movie.tag_summaries
+            ]
+
+        # Get average rating for each movie, kept up to date on every rating
+        average_ratings[movie.id] = (round(movie.avg_rating, 1), movie.num_ratings)
 
         # Get rating for each movie by the logged in user
         if get_user_ratings:
             if movie.id in all_user_ratings_dict:
                 user_ratings[movie.id] = all_user_ratings_dict[movie.id]
 
-        # Get movie plot description for each movie
-        if get_movie_plot:
-            if movie.links[0].imdb_id:
-                movie_info_url = (
-                    f"http://www.omdbapi.com/?i=tt{movie.links[0].imdb_id}&apikey="
-                )
-                thread = threading.Thread(
-                    target=fetch_movie_info,
-                    args=(movie_info_url, movie.id, request_session, movie_plot_dict),
-                )
-                threads.append(thread)
-
-    if get_movie_plot:
-        # Start all threads
-        for thread in threads:
-            thread.start()
-
-        # Wait for all threads to finish
-        for thread in threads:
-            thread.join()
+    # Get movie plot descriptions from the cache, missing ones are fetched in parallel
+    if movie_info_cache is not None:
+        imdb_ids = {movie.id: movie.links[0].imdb_id for movie in movies if movie.links}
+        movie_infos = movie_info_cache.get_many(list(imdb_ids.values()))
+        for movie_id, imdb_id in imdb_ids.items():
+            movie_plot_dict[movie_id] = movie_infos.get(imdb_id)
 
     return movie_tags, average_ratings, user_ratings, movie_plot_dict
 
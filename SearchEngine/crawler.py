@@ -1,10 +1,12 @@
 import time
-import requests
 import icecream as ic
-from typing import Union
-from bs4 import BeautifulSoup as bs
+from typing import Optional, Union
 from urllib.parse import urljoin, urlparse
 
+from fetcher import Fetcher
+from metrics import QUEUE_DEPTH
+from page_parser import parse_page
+from page_archive import PageArchive
 from custom_index import CustomIndex
 from whoosh_index import WhooshIndex
 
@@ -12,12 +14,20 @@ from whoosh_index import WhooshIndex
 class Crawler:
     """Crawler class for crawling a website and adding its contents to an index."""
 
-    def __init__(self, start_url: str, index: Union[CustomIndex, WhooshIndex]) -> None:
+    def __init__(
+        self,
+        start_url: str,
+        index: Union[CustomIndex, WhooshIndex],
+        archive: Optional[PageArchive] = None,
+        main_content_only: bool = True,
+    ) -> None:
         """Initialize the Crawler.
 
         Arguments:
             start_url (str): The url of the website to crawl.
             index (Union[Index, WhooshIndex]): The index to add the crawled contents to.
+            archive (Optional[PageArchive]): If given, all fetched responses are written to this archive.
+            main_content_only (bool): Whether to only index the main content of the pages instead of their entire text.
         """
 
         self.start_url = start_url
@@ -26,8 +36,10 @@ class Crawler:
         ).netloc  # Crawler only crawls pages from the base netloc domain
         self.url_stack = [self.start_url]
         self.visited: list[str] = []
-        self.session = requests.Session()
+        self.fetcher = Fetcher()
         self.index = index
+        self.archive = archive
+        self.main_content_only = main_content_only
 
     def crawl(self) -> None:
         """Crawl the website and add its contents to the index, if the website hasn't been visited yet.
@@ -35,36 +47,31 @@ class Crawler:
         """
 
         url = self.url_stack.pop()
+        QUEUE_DEPTH.set(len(self.url_stack))
 
         if url in self.visited:
             return
 
         self.visited.append(url)
 
-        response = self.session.get(url)
+        page = self.fetcher.fetch(url)
 
-        # Check if the response is a valid html page
-        if (
-            response.status_code == 200
-            and "text/html" in response.headers["Content-Type"]
-        ):  # evtl 300 codes
-            soup = bs(response.text, "html.parser")
+        if page is None:
+            return
 
-            title = soup.title.string if soup.title else ""
-            # Take the first 200 characters as preview text
-            first_paragraph = (
-                soup.find("p").get_text()[:200] + "..." if soup.find("p") else ""
-            )
-            text = soup.get_text() if soup.get_text() else ""
+        if self.archive is not None:
+            self.archive.write(url, page.status_code, page.headers, page.text or "")
 
-            # Convert elements to strings to avoid pickling errors
-            self.index.add_to_cache(
-                str(title), str(first_paragraph), str(text), str(url)
+        # The body is only downloaded for valid html pages
+        if page.text is not None:
+            title, first_paragraph, text, links = parse_page(
+                page.text, self.main_content_only
             )
 
+            self.index.add_to_cache(title, first_paragraph, text, str(url))
+
             # Gather all available links on the website
-            for link in soup.find_all("a"):
-                new_url = link.get("href")
+            for new_url in links:
                 complete_new_url = urljoin(self.start_url, new_url)
 
                 if urlparse(complete_new_url).netloc != self.base_netloc:
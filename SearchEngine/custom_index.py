@@ -6,6 +6,8 @@ from nltk import word_tokenize
 from collections import Counter
 from nltk.corpus import stopwords
 
+from metrics import QUERY_STAGE_SECONDS
+
 nltk.download("stopwords")
 
 
@@ -28,7 +30,7 @@ class CustomIndex:
         self.dir_name = dir_name
 
         if load_from_file:
-            with open(f"index/{self.dir_name}.pickle", "rb") as file:
+            with open(f"index/{self.dir_name}/index.pickle", "rb") as file:
                 self.index = pickle.load(file)
         else:
             if not os.path.exists(f"index/{self.dir_name}"):
@@ -67,8 +69,33 @@ class CustomIndex:
             url (str): The URL of the page.
         """
 
-        preprocessed_text = self._preprocess(text)
-        counted_words = Counter(preprocessed_text)
+        self.add_counted_to_cache(title, first_paragraph, self.count_words(text), url)
+
+    def count_words(self, text: str) -> Counter:
+        """Preprocess the text and count the occurences of every word. Does not modify the index,
+        so it can run in another process than the one building the index.
+
+        Arguments:
+            text (str): The enitire text of the page.
+
+        Returns:
+            Counter: The occurences of every preprocessed word.
+        """
+
+        return Counter(self._preprocess(text))
+
+    def add_counted_to_cache(
+        self, title: str, first_paragraph: str, counted_words: Counter, url: str
+    ) -> None:
+        """Add a page whose words were already counted by count_words to the cache.
+
+        Arguments:
+            title (str): The title of the page.
+            first_paragraph (str): The first paragraph of the page.
+            counted_words (Counter): The occurences of every preprocessed word of the page.
+            url (str): The URL of the page.
+        """
+
         self.cache.append((counted_words, url, first_paragraph, title))
 
     def build_index(self) -> None:
@@ -84,6 +111,25 @@ class CustomIndex:
         with open(f"index/{self.dir_name}/index.pickle", "wb") as file:
             pickle.dump(self.index, file)
 
+        num_postings = sum(len(postings) for postings in self.index.values())
+        print(f"Built index with {len(self.index)} terms and {num_postings} postings")
+
+    def merge(self, dir_name: str) -> None:
+        """Merge a partial index that was built and saved by another CustomIndex into this index.
+
+        Arguments:
+            dir_name (str): The name of the dir the partial index was saved to.
+        """
+
+        with open(f"index/{dir_name}/index.pickle", "rb") as file:
+            partial_index = pickle.load(file)
+
+        for word, postings in partial_index.items():
+            if word not in self.index:
+                self.index[word] = []
+
+            self.index[word].extend(postings)
+
     def search(self, query: str) -> list[list]:
         """Search the index for the query.
 
@@ -95,32 +141,35 @@ class CustomIndex:
                 first paragraph, and title, sort by total count.
         """
 
-        preprocessed_query = set(self._preprocess(query))
+        with QUERY_STAGE_SECONDS.labels("custom", "tokenise").time():
+            preprocessed_query = set(self._preprocess(query))
 
         # Get search hits
-        search_hits = []
-        for word in preprocessed_query:
-            if word in self.index:
-                search_hits.extend(self.index[word])
-
-        # Sort and group data by URL
-        search_hits.sort(key=lambda x: x[0])
-        grouped_data = itertools.groupby(search_hits, key=lambda x: x[0])
-
-        # Create result list with URL, sum of counts, and sets of first_paragraph and title
-        # For compatibility with the WhooshIndex, the first list is empty
-        # instead of containing the corrected query
-        result = [[], []]
-        for url, group in grouped_data:
-            group_list = list(group)
-            total_count = sum(item[1] for item in group_list)
-            first_paragraph = next(
-                iter({item[2] for item in group_list}), "Preview unavailable"
-            )
-            title = next(iter({item[3] for item in group_list}), "Untitled")
-            result[1].append((url, total_count, first_paragraph, title))
-
-        # Sort the result by count
-        result[1].sort(key=lambda x: x[1], reverse=True)
+        with QUERY_STAGE_SECONDS.labels("custom", "posting_lookup").time():
+            search_hits = []
+            for word in preprocessed_query:
+                if word in self.index:
+                    search_hits.extend(self.index[word])
+
+        with QUERY_STAGE_SECONDS.labels("custom", "ranking").time():
+            # Sort and group data by URL
+            search_hits.sort(key=lambda x: x[0])
+            grouped_data = itertools.groupby(search_hits, key=lambda x: x[0])
+
+            # Create result list with URL, sum of counts, and sets of first_paragraph and title
+            # For compatibility with the WhooshIndex, the first list is empty
+            # instead of containing the corrected query
+            result = [[], []]
+            for url, group in grouped_data:
+                group_list = list(group)
+                total_count = sum(item[1] for item in group_list)
+                first_paragraph = next(
+                    iter({item[2] for item in group_list}), "Preview unavailable"
+                )
+                title = next(iter({item[3] for item in group_list}), "Untitled")
+                result[1].append((url, total_count, first_paragraph, title))
+
+            # Sort the result by count
+            result[1].sort(key=lambda x: x[1], reverse=True)
 
         return result
@@ -0,0 +1,263 @@
+import os
+import zlib
+import shutil
+import multiprocessing
+from multiprocessing.connection import wait
+from queue import Empty
+from typing import Union
+from collections import deque
+from urllib.parse import urljoin, urlparse, urldefrag
+
+from fetcher import Fetcher
+from metrics import QUEUE_DEPTH, text_chars
+from page_parser import parse_page
+from custom_index import CustomIndex
+from whoosh_index import WhooshIndex
+
+
+def normalize_url(url: str) -> str:
+    """Normalize a url so that different spellings of the same page map to the same partition.
+    The fragment is removed and the scheme and netloc are lowercased.
+
+    Arguments:
+        url (str): The url to normalize.
+
+    Returns:
+        str: The normalized url.
+    """
+
+    url, _ = urldefrag(url)
+    parsed = urlparse(url)
+
+    return parsed._replace(
+        scheme=parsed.scheme.lower(),
+        netloc=parsed.netloc.lower(),
+        path=parsed.path or "/",
+    ).geturl()
+
+
+def url_partition(url: str, num_partitions: int) -> int:
+    """Get the partition that owns a normalized url. A stable hash is used,
+    so that all processes agree on the owner regardless of their hash seed.
+
+    Arguments:
+        url (str): The normalized url.
+        num_partitions (int): The total number of partitions.
+
+    Returns:
+        int: The index of the owning partition.
+    """
+
+    return zlib.crc32(url.encode("utf8")) % num_partitions
+
+
+def _crawl_partition(
+    partition: int,
+    start_url: str,
+    index_class: type,
+    dir_name: str,
+    inboxes: list,
+    pending,
+    total_text_chars,
+    main_content_only: bool,
+) -> None:
+    """Crawl all urls owned by one partition and build a partial index from them.
+    Runs in its own process. Links owned by other partitions are forwarded to their inbox.
+
+    The shared pending counter holds the number of urls that were sent to a partition but not yet
+    processed. It is incremented before a url is sent and decremented after all links of the
+    url have been sent, so it only drops to zero once the whole website has been crawled.
+
+    Arguments:
+        partition (int): The index of this partition.
+        start_url (str): The url of the website to crawl.
+        index_class (type): The class of the index to build the partial index with.
+        dir_name (str): The name of the dir the partial index is saved to.
+        inboxes (list[multiprocessing.Queue]): The inboxes of all partitions.
+        pending (multiprocessing.Value): The number of urls that are yet to be processed.
+        total_text_chars (multiprocessing.Array): The number of full and indexed text characters
+            of the pages parsed by all partitions.
+        main_content_only (bool): Whether to only index the main content of the pages.
+    """
+
+    base_netloc = urlparse(start_url).netloc
+    num_partitions = len(inboxes)
+    inbox = inboxes[partition]
+
+    visited: set[str] = set()
+    # Urls that were already sent to a partition, avoids flooding the queues with duplicates
+    sent: set[str] = set()
+    frontier: deque[str] = deque()
+
+    fetcher = Fetcher()
+    index = index_class(dir_name=dir_name)
+    # The counters of this process start with the values of the parent process
+    start_full_chars, start_indexed_chars = text_chars()
+
+    while True:
+        # Move all urls from the inbox to the local frontier
+        try:
+            while True:
+                frontier.append(inbox.get_nowait())
+        except Empty:
+            pass
+
+        if not frontier:
+            with pending.get_lock():
+                if pending.value == 0:
+                    break
+            try:
+                frontier.append(inbox.get(timeout=0.1))
+            except Empty:
+                continue
+
+        url = frontier.popleft()
+        QUEUE_DEPTH.set(len(frontier))
+
+        try:
+            if url in visited:
+                continue
+            visited.add(url)
+
+            page = fetcher.fetch(url)
+
+            # The body is only downloaded for valid html pages
+            if page is None or page.text is None:
+                continue
+
+            title, first_paragraph, text, links = parse_page(
+                page.text, main_content_only
+            )
+
+            index.add_to_cache(title, first_paragraph, text, url)
+
+            # Gather all available links on the website and send them to their owner
+            for new_url in links:
+                complete_new_url = normalize_url(urljoin(start_url, new_url))
+
+                if urlparse(complete_new_url).netloc != base_netloc:
+                    continue
+
+                if complete_new_url in sent:
+                    continue
+                sent.add(complete_new_url)
+
+                with pending.get_lock():
+                    pending.value += 1
+
+                owner = url_partition(complete_new_url, num_partitions)
+                if owner == partition:
+                    frontier.append(complete_new_url)
+                else:
+                    inboxes[owner].put(complete_new_url)
+
+        # A single broken page must not stop the partition, the others would wait for it forever
+        except Exception as error:
+            print(f"Partition {partition} failed to process {url}: {error!r}")
+
+        finally:
+            with pending.get_lock():
+                pending.value -= 1
+
+    full_chars, indexed_chars = text_chars()
+    with total_text_chars.get_lock():
+        total_text_chars[0] += full_chars - start_full_chars
+        total_text_chars[1] += indexed_chars - start_indexed_chars
+
+    index.build_index()
+
+
+class DistributedCrawler:
+    """Crawler class for crawling a website and adding its contents to an index. This version uses
+    multiple processes, each owning the urls whose hash falls into its partition.
+    """
+
+    def __init__(
+        self,
+        start_url: str,
+        index: Union[CustomIndex, WhooshIndex],
+        main_content_only: bool = True,
+    ) -> None:
+        """Initialize the Crawler.
+
+        Arguments:
+            start_url (str): The url of the website to crawl.
+            index (Union[Index, WhooshIndex]): The index to merge the crawled contents into.
+            main_content_only (bool): Whether to only index the main content of the pages instead of their entire text.
+        """
+
+        self.start_url = normalize_url(start_url)
+        self.index = index
+        self.main_content_only = main_content_only
+
+    def start_crawling(
+        self, num_processes: int = os.cpu_count()
+    ) -> tuple[float, float]:
+        """Start crawling the website with the specified number of processes.
+        Every process builds a partial index, which are merged into the index at the end.
+
+        Arguments:
+            num_processes (int): The number of processes and therefore partitions.
+
+        Returns:
+            tuple[float, float]: The number of full and indexed text characters of the parsed pages,
+                which are counted in the crawler processes.
+        """
+
+        inboxes = [multiprocessing.Queue() for _ in range(num_processes)]
+        pending = multiprocessing.Value("i", 1)
+        total_text_chars = multiprocessing.Array("d", 2)
+        inboxes[url_partition(self.start_url, num_processes)].put(self.start_url)
+
+        partial_dir_names = [
+            f"{self.index.dir_name}_part{partition}"
+            for partition in range(num_processes)
+        ]
+
+        processes = [
+            multiprocessing.Process(
+                target=_crawl_partition,
+                args=(
+                    partition,
+                    self.start_url,
+                    type(self.index),
+                    partial_dir_names[partition],
+                    inboxes,
+                    pending,
+                    total_text_chars,
+                    self.main_content_only,
+                ),
+            )
+            for partition in range(num_processes)
+        ]
+
+        for process in processes:
+            process.start()
+
+        # The remaining processes never finish if one dies, so they are stopped in that case
+        running = list(processes)
+        while running:
+            wait([process.sentinel for process in running])
+            for process in [process for process in running if not process.is_alive()]:
+                running.remove(process)
+                process.join()
+
+                if process.exitcode != 0:
+                    for other_process in running:
+                        other_process.terminate()
+                    for other_process in running:
+                        other_process.join()
+
+                    for partial_dir_name in partial_dir_names:
+                        shutil.rmtree(f"index/{partial_dir_name}", ignore_errors=True)
+
+                    raise RuntimeError(
+                        f"Crawler process {process.name} exited with code {process.exitcode}"
+                    )
+
+        # Merge the partial indexes and remove them afterwards
+        for partial_dir_name in partial_dir_names:
+            self.index.merge(partial_dir_name)
+            shutil.rmtree(f"index/{partial_dir_name}")
+
+        return total_text_chars[0], total_text_chars[1]
@@ -0,0 +1,144 @@
+import time
+import requests
+import threading
+from queue import LifoQueue, Empty
+from contextlib import contextmanager
+from typing import NamedTuple, Optional
+from urllib3.util import make_headers
+from requests.adapters import HTTPAdapter
+
+from metrics import PAGES_FETCHED, BYTES_FETCHED, FETCH_ERRORS
+
+# Includes br if brotli is installed, urllib3 takes care of the decompression
+ACCEPT_ENCODING = make_headers(accept_encoding=True)["accept-encoding"]
+
+
+class FetchedPage(NamedTuple):
+    """A fetched response. The text is None if the body was not downloaded,
+    i.e. if the status code or content type do not match."""
+
+    url: str
+    status_code: int
+    headers: dict
+    text: Optional[str]
+
+
+class Fetcher:
+    """Fetch layer of the crawlers. Checks status code and content type before the body is downloaded,
+    streams the body up to a byte cap and enforces timeouts. Every worker checks out its own
+    session with a small connection pool, so connections are kept alive between its requests.
+    """
+
+    def __init__(
+        self,
+        num_workers: int = 1,
+        timeout: tuple[float, float] = (5, 10),
+        max_seconds: float = 30,
+        max_bytes: int = 5 * 1024 * 1024,
+        content_type: str = "text/html",
+    ) -> None:
+        """Initialize the Fetcher.
+
+        Arguments:
+            num_workers (int): The number of workers fetching concurrently, i.e. the number of sessions.
+            timeout (tuple[float, float]): The connect and read timeout of every request in seconds.
+            max_seconds (float): The maximum time spent downloading a body, guards against stalling servers.
+            max_bytes (int): The maximum number of (decompressed) bytes read from a body, the rest is discarded.
+            content_type (str): The content type of bodies that are downloaded.
+        """
+
+        self.num_workers = num_workers
+        self.timeout = timeout
+        self.max_seconds = max_seconds
+        self.max_bytes = max_bytes
+        self.content_type = content_type
+
+        self.sessions: LifoQueue[requests.Session] = LifoQueue()
+        self.num_created = 0
+        self.lock = threading.Lock()
+
+    def _create_session(self) -> requests.Session:
+        """Create a session for a single worker.
+
+        Returns:
+            requests.Session: The session.
+        """
+
+        session = requests.Session()
+        session.headers["Accept-Encoding"] = ACCEPT_ENCODING
+
+        # A worker sends one request at a time, so one connection per host is enough
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=1)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+
+        return session
+
+    @contextmanager
+    def _session(self):
+        """Check out a session for the duration of a request. Blocks if all sessions are in use.
+
+        Yields:
+            requests.Session: The session.
+        """
+
+        try:
+            session = self.sessions.get_nowait()
+        except Empty:
+            with self.lock:
+                create = self.num_created < self.num_workers
+                if create:
+                    self.num_created += 1
+            session = self._create_session() if create else self.sessions.get()
+
+        try:
+            yield session
+        finally:
+            self.sessions.put(session)
+
+    def fetch(self, url: str) -> Optional[FetchedPage]:
+        """Fetch a url. The body is only downloaded for successful responses with a matching content type.
+
+        Arguments:
+            url (str): The url to fetch.
+
+        Returns:
+            Optional[FetchedPage]: The fetched page or None if the request failed.
+        """
+
+        try:
+            with self._session() as session:
+                with session.get(url, stream=True, timeout=self.timeout) as response:
+                    PAGES_FETCHED.labels(response.status_code).inc()
+
+                    if not (
+                        response.status_code == 200
+                        and self.content_type
+                        in response.headers.get("Content-Type", "")
+                    ):
+                        return FetchedPage(
+                            url, response.status_code, response.headers, None
+                        )
+
+                    body = bytearray()
+                    deadline = time.monotonic() + self.max_seconds
+
+                    for chunk in response.iter_content(chunk_size=64 * 1024):
+                        body += chunk
+                        if len(body) >= self.max_bytes or time.monotonic() > deadline:
+                            break
+
+                    BYTES_FETCHED.inc(len(body))
+
+                    text = bytes(body[: self.max_bytes]).decode(
+                        response.encoding or "utf-8", errors="replace"
+                    )
+
+                    return FetchedPage(
+                        url, response.status_code, response.headers, text
+                    )
+
+        except requests.RequestException as error:
+            FETCH_ERRORS.inc()
+            print(f"Failed to fetch {url}: {error}")
+            return None
@@ -12,13 +12,21 @@ os.chdir(__location__)
 
 import traceback
 from time import perf_counter
-from flask import Flask, request, render_template, redirect, url_for
+from flask import Flask, Response, request, render_template, redirect, url_for
 
 from custom_index import CustomIndex
 from whoosh_index import WhooshIndex
 
 from crawler import Crawler
 from parallel_crawler import ParallelCrawler
+from distributed_crawler import DistributedCrawler
+from page_archive import PageArchive, reindex_from_archive
+from metrics import (
+    QUERY_STAGE_SECONDS,
+    generate_metrics,
+    indexed_text_ratio,
+    text_chars,
+)
 
 
 app = Flask(__name__)
@@ -51,28 +59,87 @@ def search():
         "search_time": search_time,
     }
 
-    return render_template(
-        "search_results.html",
-        search_results=search_results,
-        query=query,
-        additional_info=additional_info,
-    )
+    with QUERY_STAGE_SECONDS.labels(INDEX_BACKEND, "render").time():
+        return render_template(
+            "search_results.html",
+            search_results=search_results,
+            query=query,
+            additional_info=additional_info,
+        )
+
+
+@app.route("/metrics")
+def metrics():
+    """Exposes the query stage latencies and crawl counters in the Prometheus text format."""
+
+    rendered_metrics, content_type = generate_metrics()
+
+    return Response(rendered_metrics, content_type=content_type)
 
 
 START_URL = "https://vm009.rz.uos.de/crawl/index.html"
+# "whoosh" uses the WhooshIndex, "custom" uses the CustomIndex
+INDEX_BACKEND = "whoosh"
 INDEX_DIR_NAME = "whoosh_vm009"
 LOAD_INDEX_FROM_FILE = False
 
+ARCHIVE_FILE_NAME = "vm009"
+WRITE_ARCHIVE = False
+REINDEX_FROM_ARCHIVE = False
+
+# "threads" crawls with one process and NUM_THREADS threads,
+# "processes" partitions the urls across NUM_PROCESSES processes
+CRAWL_MODE = "threads"
+
+# Only index the main content of pages, without navigation, footers and scripts
+MAIN_CONTENT_ONLY = True
+
 NUM_THREADS = 4
+NUM_PROCESSES = os.cpu_count()
 DEBUG = False
 
 
-index = WhooshIndex(load_from_file=LOAD_INDEX_FROM_FILE, dir_name=INDEX_DIR_NAME)
+# When served with gunicorn (see gunicorn.conf.py) the index is loaded once
+# in the master process and shared by all forked worker processes
+index_class = {"whoosh": WhooshIndex, "custom": CustomIndex}[INDEX_BACKEND]
+index = index_class(load_from_file=LOAD_INDEX_FROM_FILE, dir_name=INDEX_DIR_NAME)
 
 if not LOAD_INDEX_FROM_FILE:
-    webcrawler = ParallelCrawler(START_URL, index)
-    webcrawler.start_crawling(NUM_THREADS)
+    if REINDEX_FROM_ARCHIVE:
+        # Rebuild the index from previously fetched pages without crawling again
+        full_chars, indexed_chars = reindex_from_archive(
+            PageArchive(ARCHIVE_FILE_NAME),
+            index,
+            NUM_PROCESSES,
+            main_content_only=MAIN_CONTENT_ONLY,
+        )
+
+    elif CRAWL_MODE == "processes":
+        webcrawler = DistributedCrawler(
+            START_URL, index, main_content_only=MAIN_CONTENT_ONLY
+        )
+        full_chars, indexed_chars = webcrawler.start_crawling(NUM_PROCESSES)
+
+    else:
+        archive = PageArchive(ARCHIVE_FILE_NAME) if WRITE_ARCHIVE else None
+
+        webcrawler = ParallelCrawler(
+            START_URL, index, archive=archive, main_content_only=MAIN_CONTENT_ONLY
+        )
+        webcrawler.start_crawling(NUM_THREADS)
+
+        if archive is not None:
+            archive.close()
+
+        full_chars, indexed_chars = text_chars()
 
     index.build_index()
 
-app.run(debug=DEBUG)
+    # Pages parsed in other processes are counted there and reported back
+    text_ratio = indexed_text_ratio(full_chars, indexed_chars)
+    if MAIN_CONTENT_ONLY and text_ratio < 1.0:
+        print(f"Main content extraction removed {1 - text_ratio:.1%} of the page text")
+
+# Start development web server
+if __name__ == "__main__":
+    app.run(debug=DEBUG)
@@ -0,0 +1,38 @@
+# Production serving of the search engine: gunicorn -c gunicorn.conf.py
+import gc
+import os
+
+wsgi_app = "flask_search_engine:app"
+bind = os.environ.get("SEARCH_ENGINE_BIND", "127.0.0.1:8000")
+workers = int(os.environ.get("SEARCH_ENGINE_WORKERS", os.cpu_count()))
+
+# Load the app and therefore the index once in the master process before forking the workers.
+# The CustomIndex is shared copy-on-write, the WhooshIndex segments are memory-mapped by every
+# worker and therefore shared through the page cache.
+preload_app = True
+
+
+def pre_fork(server, worker) -> None:
+    """Moves all objects loaded so far (i.e. the index) into the permanent generation,
+    so that the garbage collector of the workers doesn't write to their pages and copy them.
+
+    Arguments:
+        server (gunicorn.arbiter.Arbiter): The gunicorn master.
+        worker (gunicorn.workers.base.Worker): The worker that is about to be forked.
+    """
+
+    gc.freeze()
+
+
+def child_exit(server, worker) -> None:
+    """Removes the live gauges of an exited worker when metrics are aggregated across processes.
+
+    Arguments:
+        server (gunicorn.arbiter.Arbiter): The gunicorn master.
+        worker (gunicorn.workers.base.Worker): The worker that exited.
+    """
+
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        from prometheus_client import multiprocess
+
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,103 @@
+import os
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+# Latency of the individual stages of a query, from tokenisation to rendering the results
+QUERY_STAGE_SECONDS = Histogram(
+    "search_query_stage_seconds",
+    "Time spent in each stage of a search query.",
+    ["backend", "stage"],
+    buckets=(
+        0.0001,
+        0.0005,
+        0.001,
+        0.0025,
+        0.005,
+        0.01,
+        0.025,
+        0.05,
+        0.1,
+        0.25,
+        0.5,
+        1,
+        2.5,
+    ),
+)
+
+# Crawl counters, shared by all crawlers through the fetcher
+PAGES_FETCHED = Counter(
+    "crawler_pages_fetched_total", "Number of fetched responses.", ["status_code"]
+)
+BYTES_FETCHED = Counter(
+    "crawler_bytes_fetched_total", "Number of (decompressed) body bytes downloaded."
+)
+FETCH_ERRORS = Counter("crawler_fetch_errors_total", "Number of failed requests.")
+TEXT_CHARS = Counter(
+    "crawler_text_chars_total",
+    "Number of text characters of parsed pages, in full and after main content extraction.",
+    ["kind"],
+)
+QUEUE_DEPTH = Gauge(
+    "crawler_queue_depth",
+    "Number of urls waiting to be crawled.",
+    multiprocess_mode="livesum",
+)
+
+
+def text_chars() -> tuple[float, float]:
+    """Get the number of text characters of the pages parsed in this process, in full and after
+    main content extraction. Processes that parse pages for another process report the
+    difference of these counts to it.
+
+    Returns:
+        tuple[float, float]: The number of full and indexed text characters.
+    """
+
+    full_chars = REGISTRY.get_sample_value("crawler_text_chars_total", {"kind": "full"})
+    indexed_chars = REGISTRY.get_sample_value(
+        "crawler_text_chars_total", {"kind": "indexed"}
+    )
+
+    return full_chars or 0.0, indexed_chars or 0.0
+
+
+def indexed_text_ratio(full_chars: float, indexed_chars: float) -> float:
+    """Get the share of the page text that was added to the index after main content extraction.
+
+    Arguments:
+        full_chars (float): The number of full text characters of the parsed pages.
+        indexed_chars (float): The number of indexed text characters of the parsed pages.
+
+    Returns:
+        float: The ratio of indexed to full text characters, 1.0 if no page was parsed.
+    """
+
+    if not full_chars:
+        return 1.0
+
+    return indexed_chars / full_chars
+
+
+def generate_metrics() -> tuple[bytes, str]:
+    """Render all metrics in the Prometheus text format. If the PROMETHEUS_MULTIPROC_DIR environment
+    variable is set, the metrics of all processes (gunicorn workers, crawler processes) are aggregated.
+
+    Returns:
+        tuple[bytes, str]: The rendered metrics and their content type.
+    """
+
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,207 @@
+import os
+import gzip
+import json
+import itertools
+import threading
+from collections import Counter
+from typing import Iterator, Optional, Union
+from requests.structures import CaseInsensitiveDict
+from concurrent.futures import ProcessPoolExecutor
+
+from metrics import text_chars
+from page_parser import parse_page
+from custom_index import CustomIndex
+from whoosh_index import WhooshIndex
+
+
+class PageArchive:
+    """Append-only, gzip compressed archive of fetched pages (similar to a WARC file).
+    Every record is stored as one json line containing the url, status code, headers and body
+    of a response, so that the index can be rebuilt without fetching the pages again.
+    """
+
+    def __init__(self, file_name: str = "page_archive") -> None:
+        """Initialize the PageArchive.
+
+        Arguments:
+            file_name (str): The name of the archive file inside the archive dir.
+        """
+
+        self.path = f"archive/{file_name}.jsonl.gz"
+        self.file = None
+        self.lock = threading.Lock()
+
+        if not os.path.exists("archive"):
+            os.makedirs("archive")
+
+    def write(self, url: str, status_code: int, headers: dict, body: str) -> None:
+        """Append a fetched response to the archive in a thread-safe manner.
+
+        Arguments:
+            url (str): The url of the page.
+            status_code (int): The status code of the response.
+            headers (dict): The headers of the response.
+            body (str): The decoded body of the response.
+        """
+
+        record = json.dumps(
+            {
+                "url": url,
+                "status_code": status_code,
+                "headers": dict(headers),
+                "body": body,
+            }
+        )
+
+        with self.lock:
+            # Opening in append mode adds a new gzip member, so earlier crawls are kept
+            if self.file is None:
+                self.file = gzip.open(self.path, "at", encoding="utf8")
+            self.file.write(record + "\n")
+
+    def close(self) -> None:
+        """Flush and close the archive file."""
+
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+    def read(self) -> Iterator[dict]:
+        """Read all records from the archive in the order they were written.
+        A truncated last record (e.g. from an aborted crawl) is skipped.
+
+        Yields:
+            record (dict): A dict with the url, status_code, headers and body of a response.
+        """
+
+        with gzip.open(self.path, "rt", encoding="utf8") as file:
+            try:
+                for line in file:
+                    yield json.loads(line)
+            except (EOFError, json.JSONDecodeError):
+                return
+
+
+# The custom index of the reindexing process, used by the worker processes to count the words
+_worker_index: Optional[CustomIndex] = None
+
+
+def _init_worker(index: Optional[CustomIndex]) -> None:
+    """Initialize a worker process of the reindexing pool.
+
+    Arguments:
+        index (Optional[CustomIndex]): The custom index whose words are counted in the worker
+            processes, None for other indexes.
+    """
+
+    global _worker_index
+    _worker_index = index
+
+
+def _parse_record(
+    record: dict, main_content_only: bool
+) -> tuple[str, str, Union[str, Counter], str, float, float]:
+    """Parse an archived html page. Runs in a worker process of the reindexing pool.
+    For the custom index, the words of the text are preprocessed and counted here as well.
+
+    Arguments:
+        record (dict): The archived record.
+        main_content_only (bool): Whether to only use the main content of the page as text.
+
+    Returns:
+        tuple[str, str, Union[str, Counter], str, float, float]: The title, first paragraph,
+            text (or its counted words) and url of the page and the number of its full and indexed
+            text characters.
+    """
+
+    full_chars, indexed_chars = text_chars()
+    title, first_paragraph, text, _ = parse_page(record["body"], main_content_only)
+    new_full_chars, new_indexed_chars = text_chars()
+
+    return (
+        title,
+        first_paragraph,
+        _worker_index.count_words(text) if _worker_index is not None else text,
+        record["url"],
+        new_full_chars - full_chars,
+        new_indexed_chars - indexed_chars,
+    )
+
+
+def reindex_from_archive(
+    archive: PageArchive,
+    index: Union[CustomIndex, WhooshIndex],
+    num_processes: int = os.cpu_count(),
+    chunk_size: int = 256,
+    main_content_only: bool = True,
+) -> tuple[float, float]:
+    """Replay an archive through the parsing and add_to_cache pipeline without refetching any page.
+    Parsing is done in parallel by a pool of processes, the parsed pages are added to the index
+    in the order they were archived. The preprocessing runs in parallel as well, the words are
+    counted by the pool for the custom index and Whoosh analyses the documents in multiple
+    processes. Only the latest record of every url is used, so pages that
+    were crawled again are indexed with their current content. Finding the latest records takes an
+    additional pass over the archive.
+
+    Arguments:
+        archive (PageArchive): The archive to replay.
+        index (Union[CustomIndex, WhooshIndex]): The index to add the archived pages to.
+        num_processes (int): The number of processes used for parsing and preprocessing.
+        chunk_size (int): The number of records that are parsed per batch, bounds the memory usage.
+        main_content_only (bool): Whether to only index the main content of the pages instead of their entire text.
+
+    Returns:
+        tuple[float, float]: The number of full and indexed text characters of the parsed pages,
+            which are counted in the worker processes.
+    """
+
+    # The position of the latest record of every url
+    latest = {record["url"]: position for position, record in enumerate(archive.read())}
+
+    # Apply the same checks as the crawlers do before parsing a page
+    def html_records() -> Iterator[dict]:
+        for position, record in enumerate(archive.read()):
+            if latest[record["url"]] != position:
+                continue
+
+            headers = CaseInsensitiveDict(record["headers"])
+            if record["status_code"] == 200 and "text/html" in headers.get(
+                "Content-Type", ""
+            ):
+                yield record
+
+    records = html_records()
+    total_full_chars, total_indexed_chars = 0.0, 0.0
+
+    custom_index = index if isinstance(index, CustomIndex) else None
+    if isinstance(index, WhooshIndex):
+        index.use_parallel_writer(num_processes)
+
+    with ProcessPoolExecutor(
+        max_workers=num_processes, initializer=_init_worker, initargs=(custom_index,)
+    ) as executor:
+        while batch := list(itertools.islice(records, chunk_size)):
+            for (
+                title,
+                first_paragraph,
+                content,
+                url,
+                full_chars,
+                indexed_chars,
+            ) in executor.map(
+                _parse_record,
+                batch,
+                itertools.repeat(main_content_only),
+                chunksize=max(1, chunk_size // num_processes),
+            ):
+                if custom_index is not None:
+                    custom_index.add_counted_to_cache(
+                        title, first_paragraph, content, url
+                    )
+                else:
+                    index.add_to_cache(title, first_paragraph, content, url)
+                total_full_chars += full_chars
+                total_indexed_chars += indexed_chars
+
+    return total_full_chars, total_indexed_chars
@@ -0,0 +1,117 @@
+from bs4 import BeautifulSoup as bs
+
+from metrics import TEXT_CHARS
+
+# Elements that never contain the main content of a page
+BOILERPLATE_TAGS = [
+    "script",
+    "style",
+    "noscript",
+    "template",
+    "iframe",
+    "svg",
+    "nav",
+    "header",
+    "footer",
+    "aside",
+    "form",
+]
+# Elements that hold a block of text
+BLOCK_TAGS = [
+    "p",
+    "h1",
+    "h2",
+    "h3",
+    "h4",
+    "h5",
+    "h6",
+    "li",
+    "dt",
+    "dd",
+    "td",
+    "th",
+    "pre",
+    "blockquote",
+    "figcaption",
+    "div",
+    "section",
+]
+# Blocks that mostly consist of link text (menus, link lists, pagination) are dropped
+MAX_LINK_DENSITY = 0.5
+
+
+def extract_main_content(soup: bs) -> str:
+    """Extract the main content of a page, leaving out navigation, footers, scripts and other boilerplate
+    that is repeated on every page. The soup is modified in place.
+
+    Boilerplate elements are removed first. If the page marks its main content (main, article or
+    role="main") only that is used. Otherwise all innermost text blocks with a low link density are kept.
+
+    Arguments:
+        soup (bs): The parsed page.
+
+    Returns:
+        str: The text of the main content, or the entire text if no main content was found.
+    """
+
+    for element in soup(BOILERPLATE_TAGS):
+        element.decompose()
+
+    main = soup.find("main") or soup.find("article") or soup.find(role="main")
+    if main is not None:
+        return main.get_text(" ", strip=True)
+
+    blocks = []
+    for block in soup.find_all(BLOCK_TAGS):
+        # Only use innermost blocks, so that nested text is not added twice
+        if block.find(BLOCK_TAGS):
+            continue
+
+        text = block.get_text(" ", strip=True)
+        if not text:
+            continue
+
+        link_chars = sum(len(link.get_text(strip=True)) for link in block.find_all("a"))
+        if link_chars / len(text) > MAX_LINK_DENSITY:
+            continue
+
+        blocks.append(text)
+
+    return "\n".join(blocks) if blocks else soup.get_text()
+
+
+def parse_page(
+    html: str, main_content_only: bool = True
+) -> tuple[str, str, str, list[str]]:
+    """Parse a html page into the fields that are added to the index and the links it contains.
+
+    Arguments:
+        html (str): The html text of the page.
+        main_content_only (bool): Whether to only use the main content of the page as text,
+            instead of the entire text including navigation, footers and script text.
+
+    Returns:
+        title (str): The title of the page.
+        first_paragraph (str): The first 200 characters of the first paragraph, used as preview text.
+        text (str): The text of the page.
+        links (list[str]): The (possibly relative) targets of all links on the page.
+    """
+
+    soup = bs(html, "html.parser")
+
+    title = soup.title.string if soup.title else ""
+    # Take the first 200 characters as preview text
+    first_paragraph = soup.find("p").get_text()[:200] + "..." if soup.find("p") else ""
+    full_text = soup.get_text() if soup.get_text() else ""
+
+    # Links have to be gathered before the navigation is removed
+    links = [link.get("href") for link in soup.find_all("a")]
+
+    text = extract_main_content(soup) if main_content_only else full_text
+
+    # Track how much text the extraction removes from the index
+    TEXT_CHARS.labels("full").inc(len(full_text))
+    TEXT_CHARS.labels("indexed").inc(len(text))
+
+    # Convert elements to strings to avoid pickling errors
+    return str(title), str(first_paragraph), str(text), links
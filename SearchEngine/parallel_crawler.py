@@ -1,10 +1,12 @@
-import requests
 import threading
 from queue import Queue
-from typing import Union
-from bs4 import BeautifulSoup as bs
+from typing import Optional, Union
 from urllib.parse import urljoin, urlparse
 
+from fetcher import Fetcher
+from metrics import QUEUE_DEPTH
+from page_parser import parse_page
+from page_archive import PageArchive
 from custom_index import CustomIndex
 from whoosh_index import WhooshIndex
 
@@ -12,21 +14,32 @@ from whoosh_index import WhooshIndex
 class ParallelCrawler:
     """Crawler class for crawling a website and adding its contents to an index. This version uses multithreading."""
 
-    def __init__(self, start_url: str, index: Union[CustomIndex, WhooshIndex]) -> None:
+    def __init__(
+        self,
+        start_url: str,
+        index: Union[CustomIndex, WhooshIndex],
+        archive: Optional[PageArchive] = None,
+        main_content_only: bool = True,
+    ) -> None:
         """Initialize the Crawler.
 
         Arguments:
             start_url (str): The url of the website to crawl.
             index (Union[Index, WhooshIndex]): The index to add the crawled contents to.
+            archive (Optional[PageArchive]): If given, all fetched responses are written to this archive.
+            main_content_only (bool): Whether to only index the main content of the pages instead of their entire text.
         """
         self.start_url = start_url
         self.base_netloc = urlparse(start_url).netloc
         self.visited: set[str] = set()
         self.url_queue: Queue[str] = Queue()
         self.url_queue.put(start_url)
-        self.session = requests.Session()
+        # Created in start_crawling with one session per thread
+        self.fetcher: Optional[Fetcher] = None
         self.lock = threading.Lock()
         self.index = index
+        self.archive = archive
+        self.main_content_only = main_content_only
 
     def _crawl(self) -> None:
         """Crawl the website and add its contents to the index, if the website hasn't been visited yet.
@@ -34,6 +47,7 @@ class ParallelCrawler:
         """
 
         url = self.url_queue.get()
+        QUEUE_DEPTH.set(self.url_queue.qsize())
 
         # Check if the url has already been visited in a thread-safe manner
         with self.lock:
@@ -41,30 +55,24 @@ class ParallelCrawler:
                 return
             self.visited.add(url)
 
-        response = self.session.get(url)
+        page = self.fetcher.fetch(url)
 
-        # Check if the response is a valid html page
-        if (
-            response.status_code == 200
-            and "text/html" in response.headers["Content-Type"]
-        ):
-            soup = bs(response.text, "html.parser")
+        if page is None:
+            return
 
-            title = soup.title.string if soup.title else ""
-            # Take the first 200 characters as preview text
-            first_paragraph = (
-                soup.find("p").get_text()[:200] + "..." if soup.find("p") else ""
-            )
-            text = soup.get_text() if soup.get_text() else ""
+        if self.archive is not None:
+            self.archive.write(url, page.status_code, page.headers, page.text or "")
 
-            # Convert elements to strings to avoid pickling errors
-            self.index.add_to_cache(
-                str(title), str(first_paragraph), str(text), str(url)
+        # The body is only downloaded for valid html pages
+        if page.text is not None:
+            title, first_paragraph, text, links = parse_page(
+                page.text, self.main_content_only
             )
 
+            self.index.add_to_cache(title, first_paragraph, text, str(url))
+
             # Gather all available links on the website
-            for link in soup.find_all("a"):
-                new_url = link.get("href")
+            for new_url in links:
                 complete_new_url = urljoin(self.start_url, new_url)
 
                 if urlparse(complete_new_url).netloc != self.base_netloc:
@@ -72,11 +80,15 @@ class ParallelCrawler:
 
                 self.url_queue.put(complete_new_url)
 
+            QUEUE_DEPTH.set(self.url_queue.qsize())
+
     def start_crawling(self, num_threads: int = 1) -> None:
         """Start crawling the website with the specified number of threads.
         As long as there are urls in the url queue, each thread will crawl a url.
         """
 
+        self.fetcher = Fetcher(num_workers=num_threads)
+
         threads = []
 
         while not self.url_queue.empty():
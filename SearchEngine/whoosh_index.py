@@ -1,4 +1,7 @@
 import os
+import threading
+from queue import LifoQueue, Empty
+from contextlib import contextmanager
 
 from whoosh.qparser import QueryParser, OrGroup
 from whoosh.writing import BufferedWriter
@@ -6,18 +9,115 @@ from whoosh.fields import TEXT, ID, Schema
 from whoosh.index import create_in, open_dir
 from whoosh.highlight import SentenceFragmenter, HtmlFormatter
 
+from metrics import QUERY_STAGE_SECONDS
+
+
+class SearcherPool:
+    """Pool of long-lived Whoosh searchers that keeps the segment readers open across queries.
+    Every pooled searcher comes with its own cached query parser. After a commit the pool is
+    invalidated and the searchers pick up the new index generation via searcher.refresh().
+    """
+
+    def __init__(self, index, size: int = 8) -> None:
+        """Initialize the SearcherPool.
+
+        Arguments:
+            index (whoosh.index.Index): The index to open the searchers on.
+            size (int): The maximum number of searchers, i.e. concurrent queries.
+        """
+
+        self.index = index
+        self.size = size
+        self.generation = 0
+        self._reset()
+
+    def _reset(self) -> None:
+        """Forget all searchers. Used after a fork, as searchers must not be shared between processes."""
+
+        self.pid = os.getpid()
+        # Most recently used searchers are reused first
+        self.searchers: LifoQueue[tuple] = LifoQueue()
+        self.num_created = 0
+        self.lock = threading.Lock()
+
+    def _create(self) -> tuple:
+        """Open a new searcher and a query parser for it.
+
+        Returns:
+            tuple: The searcher, its query parser and the pool generation it is up to date with.
+        """
+
+        parser = QueryParser("content", self.index.schema, group=OrGroup.factory(0.9))
+
+        return self.index.searcher(), parser, self.generation
+
+    @contextmanager
+    def searcher(self):
+        """Check out a searcher and its query parser for the duration of a query.
+        Blocks if all searchers are in use.
+
+        Yields:
+            tuple: The searcher and its query parser.
+        """
+
+        if self.pid != os.getpid():
+            self._reset()
+
+        try:
+            entry = self.searchers.get_nowait()
+        except Empty:
+            with self.lock:
+                create = self.num_created < self.size
+                if create:
+                    self.num_created += 1
+            entry = self._create() if create else self.searchers.get()
+
+        searcher, parser, generation = entry
+
+        # Reuse unchanged segment readers and only open the new ones after a commit
+        if generation != self.generation:
+            generation = self.generation
+            searcher = searcher.refresh()
+
+        try:
+            yield searcher, parser
+        finally:
+            self.searchers.put((searcher, parser, generation))
+
+    def invalidate(self) -> None:
+        """Mark all pooled searchers as outdated, e.g. after a commit to the index."""
+
+        with self.lock:
+            self.generation += 1
+
+    def close(self) -> None:
+        """Close all searchers that are currently not in use."""
+
+        while True:
+            try:
+                searcher, _, _ = self.searchers.get_nowait()
+            except Empty:
+                break
+            searcher.close()
+            with self.lock:
+                self.num_created -= 1
+
 
 class WhooshIndex:
     """Class for building and searching an inverted index based on Whoosh."""
 
     def __init__(
-        self, load_from_file: bool = False, dir_name: str = "whoosh_index"
+        self,
+        load_from_file: bool = False,
+        dir_name: str = "whoosh_index",
+        num_searchers: int = 8,
     ) -> None:
         """Initialize the Index.
 
         Arguments:
             load_from_file (bool): Whether to load the index from a file.
             dir_name (str): The name of the dir to load the index from and save it to.
+            num_searchers (int): The maximum number of pooled searchers used for concurrent queries.
         """
 
         # Create the schema for the index, which specifies the fields that will be indexed and stored.
@@ -28,6 +128,7 @@ class WhooshIndex:
             url=ID(stored=True),
         )
 
+        self.dir_name = dir_name
         self.search_fragmenter = SentenceFragmenter(charlimit=250)
         self.highlight_formatter = HtmlFormatter(classname="change")
 
@@ -43,6 +144,8 @@ class WhooshIndex:
             )
             self.writer = BufferedWriter(self.index, period=2, limit=2)
 
+        self.searcher_pool = SearcherPool(self.index, size=num_searchers)
+
     def add_to_cache(
         self, title: str, first_paragraph: str, text: str, url: str
     ) -> None:
@@ -59,11 +162,46 @@ class WhooshIndex:
             title=title, first_paragraph=first_paragraph, content=text, url=url
         )
 
+    def use_parallel_writer(self, num_processes: int) -> None:
+        """Replace the buffered writer by a writer that analyses the added documents in multiple
+        processes, each writing its own segment. Used for bulk indexing, e.g. reindexing an archive.
+
+        Arguments:
+            num_processes (int): The number of processes analysing the documents.
+        """
+
+        self.writer.close()
+        self.writer = self.index.writer(procs=num_processes, multisegment=True)
+
     def build_index(self) -> None:
         """Build the index and save it to a file."""
 
         self.writer.commit()
-        self.writer.close()
+        # Only the buffered writer starts a new writer after a commit
+        if isinstance(self.writer, BufferedWriter):
+            self.writer.close()
+
+        self.searcher_pool.invalidate()
+
+        index_bytes = sum(
+            os.path.getsize(os.path.join(f"index/{self.dir_name}", file_name))
+            for file_name in os.listdir(f"index/{self.dir_name}")
+        )
+        print(
+            f"Built index with {self.index.doc_count()} documents and {index_bytes} bytes"
+        )
+
+    def merge(self, dir_name: str) -> None:
+        """Merge a partial index that was built and saved by another WhooshIndex into this index.
+
+        Arguments:
+            dir_name (str): The name of the dir the partial index was saved to.
+        """
+
+        partial_index = open_dir(dirname=f"index/{dir_name}", indexname="index")
+
+        with partial_index.reader() as reader:
+            self.writer.add_reader(reader)
 
     def search(self, query: str) -> list[list]:
         """Search the index for the query. If the query is misspelled, the corrected query is returned as well.
@@ -82,15 +220,16 @@ class WhooshIndex:
         # Dummy count is needed for compatibility with the custom index.
         dummy_count = 0
 
-        with self.index.searcher() as searcher:
-            parsed_query = searcher.correct_query(
-                QueryParser(
-                    "content", self.index.schema, group=OrGroup.factory(0.9)
-                ).parse(query),
-                query,
-            )
-            results = searcher.search(parsed_query.query)
-            results.fragmenter = self.search_fragmenter
+        with self.searcher_pool.searcher() as (searcher, parser):
+            with QUERY_STAGE_SECONDS.labels("whoosh", "tokenise").time():
+                parsed_query = parser.parse(query)
+
+            with QUERY_STAGE_SECONDS.labels("whoosh", "spelling_correction").time():
+                parsed_query = searcher.correct_query(parsed_query, query)
+
+            with QUERY_STAGE_SECONDS.labels("whoosh", "posting_lookup").time():
+                results = searcher.search(parsed_query.query)
+                results.fragmenter = self.search_fragmenter
 
             if parsed_query.string != query:
                 result[0] = (
@@ -98,9 +237,15 @@ class WhooshIndex:
                     parsed_query.string,
                 )
 
-            for hit in results:
-                result[1].append(
-                    (hit["url"], dummy_count, hit.highlights("content"), hit["title"])
-                )
+            with QUERY_STAGE_SECONDS.labels("whoosh", "highlighting").time():
+                for hit in results:
+                    result[1].append(
+                        (
+                            hit["url"],
+                            dummy_count,
+                            hit.highlights("content"),
+                            hit["title"],
+                        )
+                    )
 
         return result